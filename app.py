@@ -1,7 +1,6 @@
 import streamlit as st
 import pandas as pd
 from pathlib import Path
-import yaml
 from dotenv import load_dotenv
 import os
 import sys
@@ -17,6 +16,7 @@ from distance_calculator import DistanceCalculator
 from config.logging_config import setup_logging
 from utils.city_normalizer import normalize_city_name
 from utils.duplicate_cleaner import get_duplicate_count
+from utils.yaml_io import load_yaml, write_yaml_atomic
 from src.exceptions import APIRateLimitError, APIServerError, APITimeoutError, LLMError
 
 # Crear directorio de logs si no existe
@@ -49,14 +49,21 @@ PROVINCIAS = [
 def ejecutar_proceso(df, tipo_centro, provincias_seleccionadas, ciudades_lista):
     """Función que procesa los datos y genera el resultado."""
     try:
-        datos_centros = df.to_dict("records")
         llm_connector = LLMConnector()
+        barra_progreso = st.progress(0.0, text="Calculando distancias...")
+        
+        def actualizar_progreso(completados, total):
+            barra_progreso.progress(completados / total, text=f"Calculando distancias ({completados}/{total} lotes)")
+        
         prompt = llm_connector.generate_prompt(
             tipo_centro,
             provincias_seleccionadas,
             ciudades_lista,
-            datos_centros
+            df.itertuples(index=False, name=None),
+            columns=df.columns.tolist(),
+            progress_callback=actualizar_progreso
         )
+        barra_progreso.empty()
         return llm_connector.process_with_llm(prompt)
     except APIRateLimitError as e:
         return f"⚠️ {str(e)}"
@@ -76,11 +83,11 @@ def load_or_create_settings(api_key=None):
     
     if settings_path.exists():
         with open(settings_path, 'r', encoding='utf-8') as f:
-            settings = yaml.safe_load(f) or {}
+            settings = load_yaml(f) or {}
     else:
         if example_path.exists():
             with open(example_path, 'r', encoding='utf-8') as f:
-                settings = yaml.safe_load(f) or {}
+                settings = load_yaml(f) or {}
         else:
             st.error("No se encontró el archivo settings.example.yaml")
             return None
@@ -89,8 +96,7 @@ def load_or_create_settings(api_key=None):
         if 'api' not in settings:
             settings['api'] = {}
         settings['api']['mistral_api_key'] = api_key
-        with open(settings_path, 'w', encoding='utf-8') as f:
-            yaml.dump(settings, f, allow_unicode=True)
+        write_yaml_atomic(settings, settings_path)
     
     return settings
 
@@ -198,7 +204,7 @@ def render_sidebar():
                         calculator = DistanceCalculator()
                         try:
                             # Intentar obtener las coordenadas de la ciudad usando el nombre normalizado
-                            coords = calculator._get_coordinates(ciudad_normalizada, provincias_seleccionadas[0] if provincias_seleccionadas else "Granada")
+                            coords = calculator.get_coordinates(ciudad_normalizada, provincias_seleccionadas[0] if provincias_seleccionadas else "Granada")
                             if coords:
                                 st.session_state.ciudades_preferencia.append({
                                     'nombre': ciudad_normalizada,  # Guardar el nombre normalizado
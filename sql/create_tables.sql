@@ -27,6 +27,7 @@ CREATE TABLE IF NOT EXISTS distancias (
 CREATE INDEX IF NOT EXISTS idx_ciudades_nombre ON ciudades(nombre);
 CREATE INDEX IF NOT EXISTS idx_ciudades_provincia ON ciudades(provincia);
 CREATE INDEX IF NOT EXISTS idx_distancias_ciudades ON distancias(ciudad1, ciudad2);
+CREATE INDEX IF NOT EXISTS idx_distancias_ciudad2 ON distancias(ciudad2);
 
 -- Función para actualizar updated_at automáticamente
 CREATE OR REPLACE FUNCTION update_updated_at_column()
@@ -60,3 +61,126 @@ COMMENT ON TABLE distancias IS 'Caché de distancias calculadas entre ciudades';
 COMMENT ON COLUMN ciudades.latitud IS 'Latitud en grados decimales';
 COMMENT ON COLUMN ciudades.longitud IS 'Longitud en grados decimales';
 COMMENT ON COLUMN distancias.distancia IS 'Distancia en kilómetros';
+
+-- Nombre normalizado para detectar ciudades duplicadas en el servidor
+ALTER TABLE ciudades ADD COLUMN IF NOT EXISTS nombre_normalizado VARCHAR(255);
+CREATE INDEX IF NOT EXISTS idx_ciudades_nombre_normalizado ON ciudades(nombre_normalizado);
+
+-- Réplica de normalize_city_name (utils/city_normalizer.py): minúsculas, sin
+-- acentos ni signos, espacios simples y sin el primer prefijo/sufijo común
+CREATE OR REPLACE FUNCTION normalize_city_name(nombre TEXT)
+RETURNS TEXT AS $$
+DECLARE
+    resultado TEXT;
+    prefijo TEXT;
+    sufijo TEXT;
+BEGIN
+    IF nombre IS NULL THEN
+        RETURN '';
+    END IF;
+
+    resultado := translate(lower(btrim(nombre)),
+                           'áàäâãéèëêíìïîóòöôõúùüûñç',
+                           'aaaaaeeeeiiiiooooouuuunc');
+    resultado := regexp_replace(resultado, '[^[:alnum:]_[:space:]]', ' ', 'g');
+    resultado := btrim(regexp_replace(resultado, '\s+', ' ', 'g'));
+
+    -- Más largos primero, en el mismo orden que CityNameNormalizer._PREFIX_SORTED
+    FOREACH prefijo IN ARRAY ARRAY[
+        'de las ', 'de los ', 'puerto ', 'ciudad ', 'de la ',
+        'santa ', 'santo ', 'villa ', 'las ', 'los ',
+        'del ', 'san ', 'la ', 'el ', 'de '
+    ] LOOP
+        IF left(resultado, length(prefijo)) = prefijo THEN
+            resultado := btrim(substr(resultado, length(prefijo) + 1));
+            EXIT;
+        END IF;
+    END LOOP;
+
+    FOREACH sufijo IN ARRAY ARRAY[
+        ' de la frontera', ' de la sierra', ' de arriba',
+        ' de abajo', ' del mar', ' alto', ' bajo'
+    ] LOOP
+        IF right(resultado, length(sufijo)) = sufijo THEN
+            resultado := btrim(left(resultado, length(resultado) - length(sufijo)));
+            EXIT;
+        END IF;
+    END LOOP;
+
+    RETURN btrim(resultado);
+END;
+$$ LANGUAGE plpgsql IMMUTABLE;
+
+-- Mantener nombre_normalizado al insertar o renombrar ciudades
+CREATE OR REPLACE FUNCTION set_nombre_normalizado()
+RETURNS TRIGGER AS $$
+BEGIN
+    NEW.nombre_normalizado = normalize_city_name(NEW.nombre);
+    RETURN NEW;
+END;
+$$ language 'plpgsql';
+
+DROP TRIGGER IF EXISTS set_ciudades_nombre_normalizado ON ciudades;
+CREATE TRIGGER set_ciudades_nombre_normalizado
+    BEFORE INSERT OR UPDATE OF nombre ON ciudades
+    FOR EACH ROW
+    EXECUTE FUNCTION set_nombre_normalizado();
+
+-- Rellenar las ciudades existentes
+UPDATE ciudades
+SET nombre_normalizado = normalize_city_name(nombre)
+WHERE nombre_normalizado IS DISTINCT FROM normalize_city_name(nombre);
+
+-- Devuelve las ciudades cuyo nombre normalizado se repite, ordenadas por grupo y antigüedad
+CREATE OR REPLACE FUNCTION find_duplicate_cities()
+RETURNS TABLE (
+    id INTEGER,
+    nombre VARCHAR,
+    provincia VARCHAR,
+    latitud DECIMAL,
+    longitud DECIMAL,
+    created_at TIMESTAMP WITH TIME ZONE,
+    nombre_normalizado VARCHAR
+) AS $$
+    SELECT d.id, d.nombre, d.provincia, d.latitud, d.longitud, d.created_at, d.nombre_normalizado
+    FROM (
+        SELECT c.*, COUNT(*) OVER (PARTITION BY c.nombre_normalizado) AS repeticiones
+        FROM ciudades c
+        WHERE c.nombre_normalizado IS NOT NULL
+    ) d
+    WHERE d.repeticiones > 1
+    ORDER BY d.nombre_normalizado, d.created_at;
+$$ LANGUAGE sql STABLE;
+
+COMMENT ON COLUMN ciudades.nombre_normalizado IS 'Nombre sin acentos, prefijos ni sufijos comunes';
+
+-- Geometría de las ciudades para calcular distancias en el servidor (PostGIS)
+CREATE EXTENSION IF NOT EXISTS postgis;
+
+ALTER TABLE ciudades ADD COLUMN IF NOT EXISTS geom geography(Point, 4326)
+    GENERATED ALWAYS AS (
+        ST_SetSRID(ST_MakePoint(longitud::float8, latitud::float8), 4326)::geography
+    ) STORED;
+CREATE INDEX IF NOT EXISTS idx_ciudades_geom ON ciudades USING GIST(geom);
+
+-- Distancia en línea recta entre cada referencia y cada localidad ya geocodificadas,
+-- indicando si la localidad cae dentro del radio de la referencia.
+-- Parámetros: referencias [{nombre, provincia, radio}] y localidades [{nombre, provincia}]
+CREATE OR REPLACE FUNCTION reference_distances(referencias JSONB, localidades JSONB)
+RETURNS TABLE (
+    referencia VARCHAR,
+    localidad VARCHAR,
+    provincia VARCHAR,
+    distancia_km DOUBLE PRECISION,
+    dentro_radio BOOLEAN
+) AS $$
+    SELECT r.nombre, c.nombre, c.provincia,
+           ST_Distance(r.geom, c.geom) / 1000,
+           ST_DWithin(r.geom, c.geom, ref.radio * 1000)
+    FROM jsonb_to_recordset(referencias) AS ref(nombre TEXT, provincia TEXT, radio DOUBLE PRECISION)
+    JOIN ciudades r ON r.nombre = ref.nombre AND r.provincia = ref.provincia
+    CROSS JOIN jsonb_to_recordset(localidades) AS loc(nombre TEXT, provincia TEXT)
+    JOIN ciudades c ON c.nombre = loc.nombre AND c.provincia = loc.provincia;
+$$ LANGUAGE sql STABLE;
+
+COMMENT ON COLUMN ciudades.geom IS 'Punto geográfico derivado de latitud y longitud';
@@ -1,10 +1,13 @@
-from typing import Optional, List, Tuple
+from typing import Dict, Optional, List, Tuple
 from datetime import datetime
 import logging
 from .db_manager import DatabaseManager
 
 logger = logging.getLogger(__name__)
 
+# Pairs per statement, kept below SQLite's bound-parameter limit
+BULK_CHUNK_SIZE = 400
+
 class DistanceCacheManager:
     def __init__(self, db_manager: DatabaseManager):
         self.db = db_manager
@@ -28,6 +31,37 @@ class DistanceCacheManager:
                 return distancia
             return None
 
+    def obtener_distancias_cached_bulk(self, pairs: List[Tuple[int, int]]) -> Dict[Tuple[int, int], float]:
+        """Get cached distances for many (centro_id, ciudad_id) pairs at once.
+        
+        Geopy results are marked for update, as in obtener_distancia_cached.
+        Pairs missing from the result are not cached.
+        """
+        pairs = list(dict.fromkeys(pairs))
+        cached = {}
+        with self.db.get_connection() as conn:
+            cursor = conn.cursor()
+            for i in range(0, len(pairs), BULK_CHUNK_SIZE):
+                chunk = pairs[i:i + BULK_CHUNK_SIZE]
+                values = ",".join("(?, ?)" for _ in chunk)
+                params = [value for pair in chunk for value in pair]
+                cursor.execute(f"""
+                    SELECT centro_id, ciudad_id, distancia_km
+                    FROM distancias_calculadas
+                    WHERE (centro_id, ciudad_id) IN (VALUES {values})
+                """, params)
+                cached.update(((centro_id, ciudad_id), distancia) for centro_id, ciudad_id, distancia in cursor)
+                
+                # Mark geopy calculations for update
+                cursor.execute(f"""
+                    UPDATE distancias_calculadas
+                    SET necesita_actualizacion = TRUE
+                    WHERE tipo_calculo = 'geopy' AND NOT necesita_actualizacion
+                    AND (centro_id, ciudad_id) IN (VALUES {values})
+                """, params)
+            conn.commit()
+        return cached
+
     def guardar_distancia(self, centro_id: int, ciudad_id: int, distancia: float, tipo_api: str):
         """Save or update a distance calculation."""
         with self.db.get_connection() as conn:
@@ -44,6 +78,25 @@ class DistanceCacheManager:
             """, (centro_id, ciudad_id, distancia, tipo_api, datetime.now(), False))
             conn.commit()
 
+    def guardar_distancias(self, registros: List[Tuple[int, int, float, str]]):
+        """Save or update many (centro_id, ciudad_id, distancia, tipo_api) rows in one transaction."""
+        if not registros:
+            return
+        ahora = datetime.now()
+        with self.db.get_connection() as conn:
+            conn.executemany("""
+                INSERT INTO distancias_calculadas 
+                    (centro_id, ciudad_id, distancia_km, tipo_calculo, fecha_calculo, necesita_actualizacion)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT(centro_id, ciudad_id) DO UPDATE SET
+                    distancia_km = excluded.distancia_km,
+                    tipo_calculo = excluded.tipo_calculo,
+                    fecha_calculo = excluded.fecha_calculo,
+                    necesita_actualizacion = excluded.necesita_actualizacion
+            """, [(centro_id, ciudad_id, distancia, tipo_api, ahora, False)
+                  for centro_id, ciudad_id, distancia, tipo_api in registros])
+            conn.commit()
+
     def marcar_para_actualizacion(self, centro_id: int, ciudad_id: int):
         """Mark a distance calculation for update."""
         with self.db.get_connection() as conn:
@@ -72,30 +125,21 @@ class DistanceCacheManager:
         with self.db.get_connection() as conn:
             cursor = conn.cursor()
             
-            # Total cached distances
-            cursor.execute("SELECT COUNT(*) FROM distancias_calculadas")
-            total = cursor.fetchone()[0]
-            
-            # OSRM vs Geopy counts
+            # Totals, per-type counts and pending updates in a single pass
             cursor.execute("""
-                SELECT tipo_calculo, COUNT(*) 
-                FROM distancias_calculadas 
-                GROUP BY tipo_calculo
-            """)
-            tipo_counts = dict(cursor.fetchall())
-            
-            # Pending updates
-            cursor.execute("""
-                SELECT COUNT(*) 
-                FROM distancias_calculadas 
-                WHERE necesita_actualizacion = TRUE
+                SELECT
+                    COUNT(*),
+                    COALESCE(SUM(tipo_calculo = 'osrm'), 0),
+                    COALESCE(SUM(tipo_calculo = 'geopy'), 0),
+                    COALESCE(SUM(necesita_actualizacion = TRUE), 0)
+                FROM distancias_calculadas
             """)
-            pending = cursor.fetchone()[0]
+            total, osrm_count, geopy_count, pending = cursor.fetchone()
             
             return {
                 'total_cached': total,
-                'osrm_count': tipo_counts.get('osrm', 0),
-                'geopy_count': tipo_counts.get('geopy', 0),
+                'osrm_count': osrm_count,
+                'geopy_count': geopy_count,
                 'pending_updates': pending,
-                'osrm_percentage': (tipo_counts.get('osrm', 0) / total * 100) if total > 0 else 0
+                'osrm_percentage': (osrm_count / total * 100) if total > 0 else 0
             } 
\ No newline at end of file
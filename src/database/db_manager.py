@@ -118,6 +118,10 @@ class DatabaseManager:
                 CREATE INDEX IF NOT EXISTS idx_centros_municipio 
                 ON centros_educativos(municipio, provincia)
             """)
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_distancias_tipo_pendiente 
+                ON distancias_calculadas(tipo_calculo, necesita_actualizacion)
+            """)
 
             conn.commit()
             logger.info("Database initialized successfully with required tables and indexes.")
@@ -84,7 +84,7 @@ class SupabaseManager:
             Diccionario con información de la ciudad o None si no se encuentra
         """
         try:
-            query = self.supabase.table('ciudades').select('*').eq('nombre', city_name)
+            query = self.supabase.table('ciudades').select('nombre, provincia, latitud, longitud').eq('nombre', city_name).limit(1)
             
             if province:
                 query = query.eq('provincia', province)
@@ -198,6 +198,40 @@ class SupabaseManager:
             logger.error(f"Error guardando distancia: {str(e)}")
             return False
     
+    def get_reference_distances(self, references: List[Dict], localities: List[Dict]) -> Dict[Tuple[str, str, str], Tuple[float, bool]]:
+        """
+        Calcula en el servidor (PostGIS) la distancia en línea recta entre cada
+        referencia y cada localidad que ya estén geocodificadas.
+
+        Args:
+            references: Lista de diccionarios con 'nombre', 'Provincia' y 'radio'
+            localities: Lista de diccionarios con 'Localidad' y 'Provincia'
+
+        Returns:
+            Diccionario (referencia, localidad, provincia) -> (distancia_km, dentro_radio).
+            Vacío si la función reference_distances no está disponible.
+        """
+        try:
+            result = self.supabase.rpc('reference_distances', {
+                'referencias': [
+                    {'nombre': str(ref['nombre']), 'provincia': str(ref['Provincia']), 'radio': ref.get('radio', 50)}
+                    for ref in references
+                ],
+                'localidades': [
+                    {'nombre': str(loc['Localidad']), 'provincia': str(loc['Provincia'])}
+                    for loc in localities
+                ]
+            }).execute()
+
+            return {
+                (row['referencia'], row['localidad'], row['provincia']): (float(row['distancia_km']), row['dentro_radio'])
+                for row in result.data or []
+            }
+
+        except Exception as e:
+            logger.warning(f"No se pudieron calcular las distancias en el servidor: {str(e)}")
+            return {}
+
     def get_cache_stats(self) -> Dict:
         """
         Obtiene estadísticas del caché.
@@ -206,8 +240,8 @@ class SupabaseManager:
             Diccionario con estadísticas
         """
         try:
-            cities_count = self.supabase.table('ciudades').select('id', count='exact').execute()
-            distances_count = self.supabase.table('distancias').select('id', count='exact').execute()
+            cities_count = self.supabase.table('ciudades').select('id', count='exact', head=True).execute()
+            distances_count = self.supabase.table('distancias').select('id', count='exact', head=True).execute()
             
             return {
                 'ciudades': cities_count.count if cities_count.count else 0,
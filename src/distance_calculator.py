@@ -9,17 +9,61 @@ import tempfile
 from database.supabase_manager import SupabaseManager
 from database.distance_cache import DistanceCache
 import logging
+import threading
+from utils.geo import search_radius_km
 from exceptions import APIRateLimitError, APIServerError, APITimeoutError, DistanciaError
 
 logger = logging.getLogger(__name__)
 
+class RequestThrottle:
+    """Espaciado mínimo entre peticiones a un servicio público, compartido entre hilos."""
+    
+    def __init__(self, min_interval: float):
+        self.min_interval = min_interval
+        self._last_call = 0.0
+        self._lock = threading.Lock()
+    
+    def wait(self):
+        """
+        Espera hasta que hayan pasado min_interval segundos desde la petición anterior.
+        
+        El turno se reserva bajo el lock y la espera se hace fuera de él, de modo que
+        los hilos salen de uno en uno y nunca más rápido que el intervalo.
+        """
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._last_call + self.min_interval)
+            self._last_call = slot
+        
+        if slot > now:
+            time.sleep(slot - now)
+
 class DistanceCalculator:
+    # Compartidos por todas las instancias: la política de uso de Nominatim y del
+    # servidor público de OSRM es de una petición por segundo, con independencia
+    # de cuántos hilos (p. ej. los de LLMConnector.generate_prompt) las lancen
+    _nominatim_throttle = RequestThrottle(1.0)
+    _osrm_throttle = RequestThrottle(1.0)
+    
     def __init__(self):
         self.supabase_manager = SupabaseManager()
         self.cache = DistanceCache(self.supabase_manager)
         self.geocoder = Nominatim(user_agent="destinos_interinos")
         self.osrm_url = "https://router.project-osrm.org/route/v1/driving"
         
+    def get_coordinates(self, location: str, province: str = None) -> Optional[Dict]:
+        """
+        Obtiene las coordenadas de una localidad (base de datos o geocodificación).
+        
+        Args:
+            location: Nombre de la localidad
+            province: Provincia (opcional)
+            
+        Returns:
+            Diccionario con 'nombre', 'provincia', 'latitud' y 'longitud', o None si no se encuentra
+        """
+        return self._get_coordinates(location, province)
+    
     def _get_coordinates(self, location: str, province: str = None) -> Optional[Dict]:
         """
         Obtiene las coordenadas de una localidad.
@@ -39,8 +83,6 @@ class DistanceCalculator:
                 return city_info
             
             # Si no está en la base de datos, geocodificar
-            time.sleep(1)  # Rate limiting
-            
             # Usar el servicio de búsqueda de OpenStreetMap
             base_url = "https://nominatim.openstreetmap.org/search"
             headers = {
@@ -72,6 +114,7 @@ class DistanceCalculator:
                     }
                     
                     logger.info(f"Intentando geocodificar: {query}")
+                    self._nominatim_throttle.wait()
                     response = requests.get(base_url, params=params, headers=headers, timeout=10)
                     
                     # Manejar errores específicos de la API
@@ -197,6 +240,7 @@ class DistanceCalculator:
             try:
                 logger.info(f"🚗 Intentando calcular distancia con OSRM...")
                 url = f"{self.osrm_url}/{loc1_info['longitud']},{loc1_info['latitud']};{loc2_info['longitud']},{loc2_info['latitud']}"
+                self._osrm_throttle.wait()
                 response = requests.get(url, timeout=10)
                 
                 # Manejar errores específicos de OSRM
@@ -396,20 +440,32 @@ class DistanceCalculator:
                     'Provincia': str(loc['Provincia'])
                 })
         
+        # Distancias en línea recta calculadas en el servidor (PostGIS). La distancia
+        # por carretera nunca es menor, así que los pares fuera de radio se descartan
+        # sin llegar a pedir la ruta
+        straight_distances = self.supabase_manager.get_reference_distances(reference_locations, all_localities)
+        
         # Para cada localidad, calcular su distancia a cada punto de referencia
         locality_distances = []
         for locality in all_localities:
             distances = []
             for ref_loc in reference_locations:
+                radio = search_radius_km(ref_loc)
                 try:
                     # Solo calculamos la distancia si la localidad actual no es una ciudad de referencia
                     if locality['Localidad'] != ref_loc['nombre']:
+                        straight = straight_distances.get((str(ref_loc['nombre']), locality['Localidad'], locality['Provincia']))
+                        if straight is not None and straight[0] > radio:
+                            print(f"Localidad {locality['Localidad']} ({locality['Provincia']}) fuera del radio de {ref_loc['nombre']} ({straight[0]:.1f} km en línea recta > {ref_loc.get('radio', 50)} km)")
+                            distances.append((ref_loc['nombre'], float('inf')))
+                            continue
+                        
                         distance = self.get_distance(
                             ref_loc['nombre'], ref_loc['Provincia'],
                             locality['Localidad'], locality['Provincia']
                         )
                         # Verificar si la localidad está dentro del radio de la ciudad de referencia
-                        if distance <= ref_loc.get('radio', 50):
+                        if distance <= radio:
                             distances.append((ref_loc['nombre'], distance))
                             print(f"Localidad {locality['Localidad']} ({locality['Provincia']}) dentro del radio de {ref_loc['nombre']} ({distance:.1f} km)")
                         else:
@@ -1,17 +1,24 @@
 import os
 import logging
-from typing import List, Dict, Optional
-import yaml
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Iterable, List, Dict, Optional, Tuple
 import requests
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
 from distance_calculator import DistanceCalculator
 from dotenv import load_dotenv
+from utils.yaml_io import load_yaml
+from utils.geo import search_radius_km
 from exceptions import LLMError, ConfiguracionError, ValidacionError, APIRateLimitError, APIServerError, APITimeoutError
 
 # Configurar logger
 logger = logging.getLogger(__name__)
 
+# Número de localidades por lote y lotes procesados en paralelo al calcular distancias
+DEFAULT_BATCH_SIZE = 25
+DEFAULT_MAX_CONCURRENCY = 8
+
 class LLMConnector:
     """
     Conector para interactuar con modelos de lenguaje (LLM).
@@ -20,12 +27,13 @@ class LLMConnector:
     los datos de centros educativos y preferencias de ubicación.
     """
     
-    def __init__(self, config_path: str = "config/settings.yaml"):
+    def __init__(self, config_path: str = "config/settings.yaml", config: Optional[Dict] = None):
         """
         Inicializa el conector LLM.
         
         Args:
             config_path: Ruta al archivo de configuración
+            config: Configuración ya cargada; si se indica, no se lee config_path
             
         Raises:
             ConfiguracionError: Si hay error al cargar la configuración
@@ -40,15 +48,20 @@ class LLMConnector:
                 raise ValidacionError("MISTRAL_API_KEY no encontrada en variables de entorno")
             
             # Cargar configuración
-            try:
-                with open(config_path, 'r') as f:
-                    self.config = yaml.safe_load(f)
-            except Exception as e:
-                raise ConfiguracionError(f"Error al cargar configuración: {str(e)}")
+            if config is not None:
+                self.config = config
+            else:
+                try:
+                    with open(config_path, 'r') as f:
+                        self.config = load_yaml(f)
+                except Exception as e:
+                    raise ConfiguracionError(f"Error al cargar configuración: {str(e)}")
             
             # Configurar el modelo
             self.model = self.config['llm']['models']['mistral']['name']
             self.api_url = self.config['llm']['models']['mistral']['api_url']
+            self.batch_size = self.config['llm'].get('batch_size', DEFAULT_BATCH_SIZE)
+            self.max_concurrency = self.config['llm'].get('max_concurrency', DEFAULT_MAX_CONCURRENCY)
             self.headers = {
                 "Authorization": f"Bearer {api_key}",
                 "Content-Type": "application/json"
@@ -99,15 +112,25 @@ class LLMConnector:
                        tipo_centro: str, 
                        provincias: List[str], 
                        ciudades_preferencia: List[Dict], 
-                       datos_centros: List[Dict]) -> str:
+                       datos_centros: Iterable,
+                       columns: Optional[List[str]] = None,
+                       progress_callback: Optional[Callable[[int, int], None]] = None) -> str:
         """
         Genera un prompt para el LLM con los datos procesados.
         
+        Las distancias se calculan por lotes de localidades que se procesan
+        en paralelo, de modo que el tiempo total lo marca el lote más lento
+        y no la suma de todos.
+        
         Args:
             tipo_centro: Tipo de centro educativo
             provincias: Lista de provincias seleccionadas
             ciudades_preferencia: Lista de ciudades de preferencia con sus radios
-            datos_centros: Lista de diccionarios con datos de los centros
+            datos_centros: Lista de diccionarios con datos de los centros, o
+                iterable de tuplas si se indica columns
+            columns: Nombres de las columnas de cada tupla de datos_centros
+                (p. ej. df.columns.tolist() con df.itertuples(index=False, name=None))
+            progress_callback: Función opcional que recibe (lotes completados, total de lotes)
             
         Returns:
             str: Prompt generado
@@ -127,28 +150,36 @@ class LLMConnector:
                     'radio': ciudad.get('radio', 50)
                 })
             
-            # Crear diccionario de distancias para cada centro
+            # Agrupar los centros por localidad: varios centros comparten localidad
+            # y la distancia solo depende de ella
+            if columns is not None:
+                i_localidad, i_provincia = columns.index('Localidad'), columns.index('Provincia')
+                pares = ((fila[i_localidad], fila[i_provincia]) for fila in datos_centros)
+            else:
+                pares = ((centro['Localidad'], centro['Provincia']) for centro in datos_centros)
+            localidades = list(dict.fromkeys(
+                (self._normalize_city_name(localidad), provincia) for localidad, provincia in pares
+            ))
+            lotes = [localidades[i:i + self.batch_size]
+                     for i in range(0, len(localidades), self.batch_size)]
+            
+            # Calcular las distancias de cada lote en paralelo (las consultas a la caché y a
+            # la base de datos se solapan; DistanceCalculator espacia las de Nominatim y OSRM)
+            resultados = [None] * len(lotes)
+            with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+                futuros = {
+                    executor.submit(self._calculate_batch_distances, lote, ciudades_referencia): indice
+                    for indice, lote in enumerate(lotes)
+                }
+                for completados, futuro in enumerate(as_completed(futuros), start=1):
+                    resultados[futuros[futuro]] = futuro.result()
+                    if progress_callback:
+                        progress_callback(completados, len(lotes))
+            
+            # Unir los resultados en el orden original de los centros
             distancias_centros = {}
-            for centro in datos_centros:
-                localidad = self._normalize_city_name(centro['Localidad'])
-                provincia = centro['Provincia']
-                distancias = {}
-                
-                # Calcular distancia a cada ciudad de referencia
-                for ref in ciudades_referencia:
-                    try:
-                        distancia = self.distance_calculator.get_distance(
-                            location1=localidad,
-                            province1=provincia,
-                            location2=ref['nombre'],
-                            province2=ref['provincia']
-                        )
-                        distancias[ref['nombre']] = distancia
-                    except Exception as e:
-                        logger.warning(f"Error calculando distancia para {localidad}: {str(e)}")
-                        distancias[ref['nombre']] = float('inf')
-                
-                distancias_centros[f"{localidad} ({provincia})"] = distancias
+            for resultado in resultados:
+                distancias_centros.update(resultado)
             
             # Generar el prompt
             prompt = self._build_prompt(
@@ -165,6 +196,38 @@ class LLMConnector:
             logger.error(f"Error generando prompt: {str(e)}")
             raise
     
+    def _calculate_batch_distances(self,
+                                   localidades: List[Tuple[str, str]],
+                                   ciudades_referencia: List[Dict]) -> Dict[str, Dict[str, float]]:
+        """
+        Calcula las distancias de un lote de localidades a cada ciudad de referencia.
+        
+        Args:
+            localidades: Lista de tuplas (localidad, provincia)
+            ciudades_referencia: Lista de ciudades de referencia normalizadas
+            
+        Returns:
+            Diccionario {"localidad (provincia)": {ciudad_referencia: distancia}}
+        """
+        distancias_lote = {}
+        for localidad, provincia in localidades:
+            distancias = {}
+            for ref in ciudades_referencia:
+                try:
+                    distancia = self.distance_calculator.get_distance(
+                        location1=localidad,
+                        province1=provincia,
+                        location2=ref['nombre'],
+                        province2=ref['provincia']
+                    )
+                    distancias[ref['nombre']] = distancia
+                except Exception as e:
+                    logger.warning(f"Error calculando distancia para {localidad}: {str(e)}")
+                    distancias[ref['nombre']] = float('inf')
+            
+            distancias_lote[f"{localidad} ({provincia})"] = distancias
+        return distancias_lote
+    
     def _build_prompt(self, 
                      tipo_centro: str,
                      provincias: List[str],
@@ -176,16 +239,13 @@ class LLMConnector:
         # Ordenar los centros
         centros_ordenados = self._sort_centers(distancias_centros, ciudades_referencia)
         
-        # Construir el prompt
-        prompt = f"# Centros {tipo_centro} ordenados por proximidad\n\n"
+        # Construir el prompt por partes y unirlas al final
+        partes = [f"# Centros {tipo_centro} ordenados por proximidad\n\n"]
         
         # Agrupar los centros por ciudad de referencia
-        centros_por_ciudad = {}
+        centros_por_ciudad = defaultdict(list)
         for centro in centros_ordenados:
-            ciudad = centro['ciudad_ref']
-            if ciudad not in centros_por_ciudad:
-                centros_por_ciudad[ciudad] = []
-            centros_por_ciudad[ciudad].append(centro)
+            centros_por_ciudad[centro['ciudad_ref']].append(centro)
         
         # Mantener un contador continuo para todos los centros
         contador = 1
@@ -194,25 +254,26 @@ class LLMConnector:
         for ciudad in ciudades_referencia:
             nombre_ciudad = ciudad['nombre']
             if nombre_ciudad in centros_por_ciudad:
-                prompt += f"\nCiudades cercanas a {nombre_ciudad}:\n\n"
+                partes.append(f"\nCiudades cercanas a {nombre_ciudad}:\n\n")
                 # Ordenar los centros de esta ciudad por distancia
                 centros_ciudad = sorted(centros_por_ciudad[nombre_ciudad], key=lambda x: x['distancia'])
-                for centro in centros_ciudad:
-                    prompt += f"{contador}. {centro['centro']} - {centro['distancia']:.1f} km\n"
-                    contador += 1
-                prompt += "\n"  # Añadir línea en blanco después de cada grupo
+                partes.extend(
+                    f"{numero}. {centro['centro']} - {centro['distancia']:.1f} km\n"
+                    for numero, centro in enumerate(centros_ciudad, start=contador)
+                )
+                contador += len(centros_ciudad)
+                partes.append("\n")  # Añadir línea en blanco después de cada grupo
         
         # Añadir información sobre ciudades sin centros
-        ciudades_con_centros = set(centros_por_ciudad.keys())
-        ciudades_sin_centros = [ciudad['nombre'] for ciudad in ciudades_referencia 
-                               if ciudad['nombre'] not in ciudades_con_centros]
+        ciudades_sin_centros = [ciudad for ciudad in ciudades_referencia 
+                               if ciudad['nombre'] not in centros_por_ciudad]
         
         if ciudades_sin_centros:
-            prompt += "\nNo se encontraron centros dentro del radio especificado para:\n"
-            for ciudad in ciudades_sin_centros:
-                radio = next(c['radio'] for c in ciudades_referencia if c['nombre'] == ciudad)
-                prompt += f"- {ciudad} (radio: {radio} km)\n"
+            partes.append("\nNo se encontraron centros dentro del radio especificado para:\n")
+            partes.extend(f"- {ciudad['nombre']} (radio: {ciudad['radio']} km)\n"
+                          for ciudad in ciudades_sin_centros)
         
+        prompt = "".join(partes)
         return prompt
     
     def _sort_centers(self, 
@@ -232,8 +293,8 @@ class LLMConnector:
             
             for ciudad in ciudades_referencia:
                 distancia = distancias[ciudad['nombre']]
-                # Si está dentro del radio y es la más cercana hasta ahora
-                if distancia <= ciudad['radio'] and distancia < distancia_minima:
+                # Si está dentro del radio (0 = sin límite) y es la más cercana hasta ahora
+                if distancia <= search_radius_km(ciudad) and distancia < distancia_minima:
                     ciudad_mas_cercana = ciudad
                     distancia_minima = distancia
             
@@ -1,7 +1,6 @@
 import streamlit as st
 import pandas as pd
 from pathlib import Path
-import yaml
 from dotenv import load_dotenv
 import os
 import sys
@@ -16,6 +15,7 @@ from llm_connector import LLMConnector
 from styles import apply_custom_styles
 from distance_calculator import DistanceCalculator
 from config.logging_config import setup_logging
+from utils.yaml_io import load_yaml, write_yaml_atomic
 
 # Crear directorio de logs si no existe
 os.makedirs('logs', exist_ok=True)
@@ -47,14 +47,21 @@ PROVINCIAS = [
 def ejecutar_proceso(df, tipo_centro, provincias_seleccionadas, ciudades_lista):
     """Función que procesa los datos y genera el resultado."""
     try:
-        datos_centros = df.to_dict("records")
         llm_connector = LLMConnector()
+        barra_progreso = st.progress(0.0, text="Calculando distancias...")
+        
+        def actualizar_progreso(completados, total):
+            barra_progreso.progress(completados / total, text=f"Calculando distancias ({completados}/{total} lotes)")
+        
         prompt = llm_connector.generate_prompt(
             tipo_centro,
             provincias_seleccionadas,
             ciudades_lista,
-            datos_centros
+            df.itertuples(index=False, name=None),
+            columns=df.columns.tolist(),
+            progress_callback=actualizar_progreso
         )
+        barra_progreso.empty()
         return llm_connector.process_with_llm(prompt)
     except Exception as e:
         return f"Error en el proceso: {str(e)}"
@@ -66,11 +73,11 @@ def load_or_create_settings(api_key=None):
     
     if settings_path.exists():
         with open(settings_path, 'r', encoding='utf-8') as f:
-            settings = yaml.safe_load(f) or {}
+            settings = load_yaml(f) or {}
     else:
         if example_path.exists():
             with open(example_path, 'r', encoding='utf-8') as f:
-                settings = yaml.safe_load(f) or {}
+                settings = load_yaml(f) or {}
         else:
             st.error("No se encontró el archivo settings.example.yaml")
             return None
@@ -79,8 +86,7 @@ def load_or_create_settings(api_key=None):
         if 'api' not in settings:
             settings['api'] = {}
         settings['api']['mistral_api_key'] = api_key
-        with open(settings_path, 'w', encoding='utf-8') as f:
-            yaml.dump(settings, f, allow_unicode=True)
+        write_yaml_atomic(settings, settings_path)
     
     return settings
 
@@ -171,7 +177,7 @@ def render_sidebar():
                         calculator = DistanceCalculator()
                         try:
                             # Intentar obtener las coordenadas de la ciudad
-                            coords = calculator._get_coordinates(nueva_ciudad.strip(), provincias_seleccionadas[0] if provincias_seleccionadas else "Granada")
+                            coords = calculator.get_coordinates(nueva_ciudad.strip(), provincias_seleccionadas[0] if provincias_seleccionadas else "Granada")
                             if coords:
                                 st.session_state.ciudades_preferencia.append({
                                     'nombre': nueva_ciudad.strip(),
@@ -1,37 +1,74 @@
+import numpy as np
 import pandas as pd
 from pathlib import Path
-from typing import List, Dict
+from typing import List, Dict, Tuple, Union
+from functools import lru_cache
+import copy
 import os
-import yaml
 from distance_calculator import DistanceCalculator
+from utils.geo import haversine_matrix, search_radius_km
+from utils.yaml_io import load_yaml, write_yaml_atomic
 from database.db_manager import DatabaseManager
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Mapeo de nombres de provincia con tildes a nombres de directorio sin tildes
+_PROVINCE_DIR = {
+    "Almería": "Almeria",
+    "Cádiz": "Cadiz",
+    "Córdoba": "Cordoba",
+    "Jaén": "Jaen",
+    "Málaga": "Malaga",
+}
+
+# Archivo de datos según el tipo de centro (por defecto, primaria)
+_FILE_BY_TIPO = {
+    "Institutos (IES)": "centros_educativos_secundaria.csv",
+    "Colegios (CEIP)": "centros_educativos_primaria.csv",
+}
+
+# Columnas de los CSV de centros que se usan aguas abajo
+_REQUIRED_COLS = frozenset({
+    "Código", "Denominación", "Nombre", "Domicilio",
+    "Localidad", "Municipio", "Provincia",
+})
+
+def _fix_header(col):
+    """
+    Corrige la codificación de una cabecera UTF-8 leída como latin1.
+    """
+    if not isinstance(col, str):
+        return col
+    try:
+        return col.encode('latin1').decode('utf-8')
+    except (UnicodeEncodeError, UnicodeDecodeError):
+        return col
+
+@lru_cache(maxsize=32)
+def _read_configuration(path: str, mtime_ns: int, size: int) -> Dict:
+    """
+    Lee una configuración guardada. La clave incluye la fecha de modificación y el
+    tamaño del fichero, así que una configuración reescrita se vuelve a leer.
+    """
+    with open(path, "r") as f:
+        return load_yaml(f)
+
 class DataProcessor:
-    def __init__(self, data_dir: str = "data"):
+    def __init__(self, data_dir: str = "data", config_dir: str = "saved_configs"):
         self.data_dir = Path(data_dir)
+        # Directorio de las configuraciones guardadas
+        self.config_dir = Path(config_dir)
         # Inicializar la base de datos
         self.db_manager = DatabaseManager("data/distancias_cache.db")
         self.distance_calculator = DistanceCalculator()
         
-    def _normalize_province_name(self, provincia: str) -> str:
+    @staticmethod
+    def _normalize_province_name(provincia: str) -> str:
         """
         Normaliza el nombre de la provincia para que coincida con el nombre del directorio.
         """
-        # Mapeo de nombres con tildes a nombres sin tildes
-        province_mapping = {
-            "Almería": "Almeria",
-            "Cádiz": "Cadiz",
-            "Córdoba": "Cordoba",
-            "Granada": "Granada",
-            "Huelva": "Huelva",
-            "Jaén": "Jaen",
-            "Málaga": "Malaga",
-            "Sevilla": "Sevilla"
-        }
-        return province_mapping.get(provincia, provincia)
+        return _PROVINCE_DIR.get(provincia, provincia)
         
     def load_data(self, provincias: List[str], tipo_centro: str) -> pd.DataFrame:
         """
@@ -45,42 +82,38 @@ class DataProcessor:
             DataFrame con los datos de los centros
         """
         dfs = []
+        nombre_archivo = _FILE_BY_TIPO.get(tipo_centro, _FILE_BY_TIPO["Colegios (CEIP)"])
         
         for provincia in provincias:
-            # Normalizar el nombre de la provincia
-            provincia_normalizada = self._normalize_province_name(provincia)
-            
-            # Determinar el nombre del archivo según el tipo de centro
-            if tipo_centro == "Institutos (IES)":
-                archivo = f"data/{provincia_normalizada}/centros_educativos_secundaria.csv"
-            else:  # Colegios (CEIP)
-                archivo = f"data/{provincia_normalizada}/centros_educativos_primaria.csv"
+            archivo = self.data_dir / self._normalize_province_name(provincia) / nombre_archivo
             
             try:
-                print(f"Intentando cargar archivo: {archivo}")
+                logger.debug(f"Intentando cargar archivo: {archivo}")
                 # Intentar diferentes codificaciones
                 for encoding in ['utf-8', 'latin1', 'cp1252', 'iso-8859-1']:
                     try:
-                        df = pd.read_csv(archivo, encoding=encoding)
-                        print(f"Archivo cargado con codificación {encoding}: {archivo}")
+                        df = pd.read_csv(
+                            archivo,
+                            encoding=encoding,
+                            usecols=lambda col: _fix_header(col) in _REQUIRED_COLS
+                        )
+                        logger.debug(f"Archivo cargado con codificación {encoding}: {archivo}")
                         break
                     except UnicodeDecodeError:
                         continue
                 
                 # Corregir nombres de columnas
-                df.columns = [col.encode('latin1').decode('utf-8') if isinstance(col, str) else col for col in df.columns]
+                df.columns = [_fix_header(col) for col in df.columns]
                 
                 # Asegurar que la columna Provincia existe
                 if 'Provincia' not in df.columns:
                     df['Provincia'] = provincia
                 
                 dfs.append(df)
-                print(f"Archivo cargado: {archivo}")
-                print(f"Número de registros: {len(df)}")
-                print(f"Columnas: {df.columns.tolist()}")
+                logger.debug(f"Archivo cargado: {archivo} ({len(df)} registros)")
                 
             except Exception as e:
-                print(f"Error al cargar {archivo}: {str(e)}")
+                logger.warning(f"Error al cargar {archivo}: {str(e)}")
                 continue
         
         if not dfs:
@@ -89,28 +122,89 @@ class DataProcessor:
         # Combinar todos los DataFrames
         df_final = pd.concat(dfs, ignore_index=True)
         
-        # Mostrar información de depuración
-        print("\nDataFrame final:")
-        print(f"Número total de registros: {len(df_final)}")
-        print(f"Registros por provincia: {df_final['Provincia'].value_counts().to_dict()}")
+        # Resumen de depuración, solo si se va a mostrar
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(
+                f"DataFrame final: {len(df_final)} registros; "
+                f"por provincia: {df_final['Provincia'].value_counts().to_dict()}"
+            )
         
         return df_final
     
+    def _get_coordinates_array(self, lugares: List[Tuple[str, str]]) -> np.ndarray:
+        """
+        Obtiene las coordenadas en radianes de una lista de lugares.
+        
+        Args:
+            lugares: Lista de tuplas (localidad, provincia)
+            
+        Returns:
+            Array (N, 2) con latitud y longitud en radianes; NaN si no se encontró
+        """
+        coords = np.full((len(lugares), 2), np.nan)
+        for i, (localidad, provincia) in enumerate(lugares):
+            info = self.distance_calculator.get_coordinates(localidad, provincia)
+            if info:
+                coords[i] = (info['latitud'], info['longitud'])
+            else:
+                logger.warning(f"No se encontraron coordenadas para {localidad} ({provincia})")
+        return np.radians(coords)
+    
     def process_preferences(self, 
                           df: pd.DataFrame, 
-                          ciudades_preferencia: List[str]) -> List[Dict]:
+                          ciudades_preferencia: List[Union[str, Dict]]) -> List[Dict]:
         """
         Procesa las preferencias y ordena los centros según la proximidad.
         
+        Cada centro se asigna a la ciudad de preferencia más cercana dentro de
+        su radio (0 = sin límite) y el resultado se ordena por la prioridad de
+        esa ciudad y, después, por distancia. Las distancias en línea recta se
+        calculan de una vez para todas las localidades con NumPy.
+        
         Args:
             df: DataFrame con los datos de los centros
             ciudades_preferencia: Lista de ciudades en orden de preferencia
+                (nombres o diccionarios con 'nombre', 'provincia' y 'radio')
             
         Returns:
-            Lista de diccionarios con los centros ordenados
+            Lista de diccionarios con los centros ordenados, con las claves
+            adicionales 'ciudad_referencia' y 'distancia_km'
         """
-        # TODO: Implementar la lógica de ordenamiento usando el LLM
-        return []
+        if df.empty or not ciudades_preferencia:
+            return []
+        
+        ciudades = [c if isinstance(c, dict) else {'nombre': c} for c in ciudades_preferencia]
+        provincia_defecto = df['Provincia'].iloc[0]
+        
+        # Coordenadas de cada localidad única y de cada ciudad de preferencia
+        localidades = df[['Localidad', 'Provincia']].drop_duplicates().reset_index(drop=True)
+        coords_localidades = self._get_coordinates_array(list(localidades.itertuples(index=False, name=None)))
+        coords_ciudades = self._get_coordinates_array(
+            [(c['nombre'], c.get('provincia', provincia_defecto)) for c in ciudades]
+        )
+        
+        # Matriz de distancias (localidades x ciudades) y filtro por radio
+        distancias = haversine_matrix(
+            coords_localidades[:, 0], coords_localidades[:, 1],
+            coords_ciudades[:, 0], coords_ciudades[:, 1]
+        )
+        radios = np.array([search_radius_km(c) for c in ciudades], dtype=float)
+        distancias = np.where(distancias <= radios, distancias, np.inf)
+        
+        # Ciudad de referencia más cercana dentro del radio para cada localidad
+        indice_ref = np.argmin(distancias, axis=1)
+        distancia_ref = distancias[np.arange(len(localidades)), indice_ref]
+        validas = np.isfinite(distancia_ref)
+        
+        localidades = localidades.assign(
+            _indice_ref=indice_ref,
+            ciudad_referencia=[ciudades[i]['nombre'] for i in indice_ref],
+            distancia_km=distancia_ref
+        )[validas]
+        
+        resultado = df.merge(localidades, on=['Localidad', 'Provincia'])
+        resultado = resultado.sort_values(['_indice_ref', 'distancia_km'], kind='stable')
+        return resultado.drop(columns='_indice_ref').to_dict('records')
     
     def save_configuration(self, 
                           config: Dict, 
@@ -126,16 +220,19 @@ class DataProcessor:
             bool indicando si se guardó correctamente
         """
         try:
-            config_dir = Path("saved_configs")
-            config_dir.mkdir(exist_ok=True)
+            self.config_dir.mkdir(exist_ok=True)
             
-            with open(config_dir / f"{nombre}.yaml", "w") as f:
-                yaml.dump(config, f)
+            write_yaml_atomic(config, self.config_dir / f"{nombre}.yaml")
             return True
         except Exception as e:
-            print(f"Error al guardar la configuración: {e}")
+            logger.error(f"Error al guardar la configuración: {e}")
             return False
     
+    @staticmethod
+    def clear_cache():
+        """Vacía la caché de configuraciones leídas (p. ej. entre tests)."""
+        _read_configuration.cache_clear()
+    
     def load_configuration(self, nombre: str) -> Dict:
         """
         Carga una configuración guardada.
@@ -147,11 +244,13 @@ class DataProcessor:
             Diccionario con la configuración
         """
         try:
-            config_path = Path("saved_configs") / f"{nombre}.yaml"
+            config_path = self.config_dir / f"{nombre}.yaml"
             if config_path.exists():
-                with open(config_path, "r") as f:
-                    return yaml.safe_load(f)
+                stat = config_path.stat()
+                config = _read_configuration(str(config_path.resolve()), stat.st_mtime_ns, stat.st_size)
+                # Copia para que el llamante pueda modificarla sin alterar la caché
+                return copy.deepcopy(config)
             return {}
         except Exception as e:
-            print(f"Error al cargar la configuración: {e}")
+            logger.error(f"Error al cargar la configuración: {e}")
             return {} 
\ No newline at end of file
@@ -1,14 +1,65 @@
 import sys
 import os
+import csv
 sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
 
 from src.database.db_manager import DatabaseManager
-from src.database.distance_cache import DistanceCache
+from src.database.cache_manager import DistanceCacheManager
 import logging
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+def export_to_csv(db: DatabaseManager, csv_path: str) -> int:
+    """
+    Exporta las distancias cacheadas a CSV fila a fila, sin cargarlas en memoria.
+    
+    Args:
+        db: Gestor de la base de datos
+        csv_path: Ruta del fichero CSV destino
+        
+    Returns:
+        Número de filas exportadas
+    """
+    with db.get_connection() as conn, open(csv_path, 'w', newline='', encoding='utf-8') as f:
+        cursor = conn.execute("""
+            SELECT centro_id, ciudad_id, distancia_km, tipo_calculo,
+                   CAST(fecha_calculo AS TEXT) AS fecha_calculo, necesita_actualizacion
+            FROM distancias_calculadas
+        """)
+        writer = csv.writer(f)
+        writer.writerow([col[0] for col in cursor.description])
+        filas = 0
+        for row in cursor:
+            writer.writerow(row)
+            filas += 1
+    return filas
+
+def get_missing_distances(db: DatabaseManager, limit: int = 10):
+    """
+    Obtiene los pares centro-ciudad sin distancia calculada.
+    
+    Args:
+        db: Gestor de la base de datos
+        limit: Número máximo de pares a devolver
+        
+    Returns:
+        Tupla (lista de pares (centro, ciudad), total de pares faltantes)
+    """
+    with db.get_connection() as conn:
+        cursor = conn.execute("""
+            SELECT ce.municipio, cr.nombre_normalizado, COUNT(*) OVER ()
+            FROM centros_educativos ce
+            CROSS JOIN ciudades_referencia cr
+            LEFT JOIN distancias_calculadas d
+                ON d.centro_id = ce.id AND d.ciudad_id = cr.id
+            WHERE d.id IS NULL
+            LIMIT ?
+        """, (limit,))
+        rows = cursor.fetchall()
+    total = rows[0][2] if rows else 0
+    return [(origen, destino) for origen, destino, _ in rows], total
+
 def check_cache():
     """Verifica el estado de la caché de distancias."""
     try:
@@ -18,22 +69,28 @@ def check_cache():
         
         # Inicializar la caché
         db = DatabaseManager(db_path)
-        cache = DistanceCache(db)
+        cache = DistanceCacheManager(db)
         
         # Imprimir estadísticas
-        cache.print_stats()
+        stats = cache.get_cache_stats()
+        print("\nEstadísticas de la caché:")
+        print(f"- Distancias cacheadas: {stats['total_cached']}")
+        print(f"- Calculadas con OSRM: {stats['osrm_count']} ({stats['osrm_percentage']:.1f}%)")
+        print(f"- Calculadas con Geopy: {stats['geopy_count']}")
+        print(f"- Pendientes de actualización: {stats['pending_updates']}")
         
         # Exportar a CSV para análisis
         csv_path = os.path.join(base_dir, "data", "distancias_cache.csv")
-        cache.export_to_csv(csv_path)
+        filas = export_to_csv(db, csv_path)
+        print(f"\nExportadas {filas} distancias a {csv_path}")
         
         # Mostrar algunas distancias faltantes
-        missing = cache.get_missing_distances()
+        missing, total_missing = get_missing_distances(db, limit=10)
         if missing:
             print("\nPrimeras 10 distancias faltantes:")
-            for origen, destino in missing[:10]:
+            for origen, destino in missing:
                 print(f"- {origen} -> {destino}")
-            print(f"\nTotal de distancias faltantes: {len(missing)}")
+            print(f"\nTotal de distancias faltantes: {total_missing}")
         else:
             print("\n¡No hay distancias faltantes!")
             
@@ -14,6 +14,13 @@ def check_database():
     with db.get_connection() as conn:
         cursor = conn.cursor()
         
+        # Ajustes para consultas de solo lectura sobre la caché
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute("PRAGMA cache_size=-262144")  # 256 MB
+        cursor.execute("PRAGMA mmap_size=268435456")  # 256 MB
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        
         # Verificar tablas
         cursor.execute("SELECT name FROM sqlite_master WHERE type='table'")
         tables = cursor.fetchall()
@@ -21,11 +28,14 @@ def check_database():
         for table in tables:
             logger.info(f"- {table[0]}")
         
-        # Contar registros en cada tabla
-        for table in tables:
-            cursor.execute(f"SELECT COUNT(*) FROM {table[0]}")
-            count = cursor.fetchone()[0]
-            logger.info(f"Registros en {table[0]}: {count}")
+        # Contar registros de todas las tablas en una sola consulta
+        if tables:
+            query = " UNION ALL ".join(
+                f"SELECT '{table[0]}', COUNT(*) FROM \"{table[0]}\"" for table in tables
+            )
+            cursor.execute(query)
+            for nombre, count in cursor:
+                logger.info(f"Registros en {nombre}: {count}")
         
         # Mostrar algunas distancias calculadas
         cursor.execute("""
@@ -5,6 +5,7 @@ Este script identifica y elimina duplicados basándose en nombres normalizados.
 
 import sys
 import os
+from collections import defaultdict
 from pathlib import Path
 
 # Añadir el directorio src al path
@@ -19,14 +20,52 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
-def find_duplicate_cities():
+def _group_duplicates(cities):
+    """
+    Agrupa las ciudades por nombre normalizado y se queda con los grupos repetidos.
+    
+    Args:
+        cities (list): Filas de ciudades con 'nombre_normalizado' ya calculado
+        
+    Returns:
+        dict: Diccionario con ciudades duplicadas agrupadas por nombre normalizado
+    """
+    normalized_groups = defaultdict(list)
+    
+    for city in cities:
+        normalized_groups[city['nombre_normalizado']].append(city)
+    
+    duplicates = {k: v for k, v in normalized_groups.items() if len(v) > 1}
+    
+    # Solo las filas duplicadas necesitan la clave 'normalized'
+    for normalized_name, group in duplicates.items():
+        for city in group:
+            city['normalized'] = normalized_name
+    
+    return duplicates
+
+
+def find_duplicate_cities(db=None):
     """
     Encuentra ciudades duplicadas en la base de datos basándose en nombres normalizados.
     
+    La agrupación se hace en el servidor con la función find_duplicate_cities()
+    (ver sql/create_tables.sql). Si no está disponible, se descargan todas las
+    ciudades y se agrupan en local.
+    
+    Args:
+        db (SupabaseManager): Gestor de base de datos (opcional)
+    
     Returns:
         dict: Diccionario con ciudades duplicadas agrupadas por nombre normalizado
     """
-    db = SupabaseManager()
+    db = db or SupabaseManager()
+    
+    try:
+        result = db.supabase.rpc('find_duplicate_cities').execute()
+        return _group_duplicates(result.data or [])
+    except Exception as e:
+        logger.warning(f"Función find_duplicate_cities no disponible, agrupando en local: {e}")
     
     try:
         # Obtener todas las ciudades
@@ -37,29 +76,10 @@ def find_duplicate_cities():
             logger.info("No se encontraron ciudades en la base de datos")
             return {}
         
-        # Agrupar por nombre normalizado
-        normalized_groups = {}
-        
         for city in cities:
-            normalized_name = normalize_city_name(city['nombre'])
-            
-            if normalized_name not in normalized_groups:
-                normalized_groups[normalized_name] = []
-            
-            normalized_groups[normalized_name].append({
-                'id': city['id'],
-                'nombre': city['nombre'],
-                'provincia': city['provincia'],
-                'latitud': city['latitud'],
-                'longitud': city['longitud'],
-                'created_at': city['created_at'],
-                'normalized': normalized_name
-            })
+            city['nombre_normalizado'] = normalize_city_name(city['nombre'])
         
-        # Filtrar solo los grupos con duplicados
-        duplicates = {k: v for k, v in normalized_groups.items() if len(v) > 1}
-        
-        return duplicates
+        return _group_duplicates(cities)
         
     except Exception as e:
         logger.error(f"Error al buscar duplicados: {e}")
@@ -70,11 +90,15 @@ def fix_duplicate_cities(dry_run=True):
     """
     Corrige las ciudades duplicadas manteniendo la más antigua y actualizando referencias.
     
+    Las referencias en distancias se actualizan con un único upsert, quitando
+    antes las filas que repetirían un par (ciudad1, ciudad2) ya existente, y las
+    ciudades duplicadas se eliminan con un único delete.
+    
     Args:
         dry_run (bool): Si True, solo muestra lo que haría sin hacer cambios
     """
-    db = DatabaseManager()
-    duplicates = find_duplicate_cities()
+    db = SupabaseManager()
+    duplicates = find_duplicate_cities(db)
     
     if not duplicates:
         logger.info("✅ No se encontraron ciudades duplicadas")
@@ -82,7 +106,9 @@ def fix_duplicate_cities(dry_run=True):
     
     logger.info(f"🔍 Encontrados {len(duplicates)} grupos de ciudades duplicadas:")
     
-    total_removed = 0
+    # Nombre a sustituir -> nombre que se mantiene, e IDs a eliminar
+    renames = {}
+    delete_ids = []
     
     for normalized_name, cities in duplicates.items():
         logger.info(f"\n📍 Grupo '{normalized_name}':")
@@ -98,38 +124,72 @@ def fix_duplicate_cities(dry_run=True):
         
         for city in remove_cities:
             logger.info(f"  ❌ Eliminar: ID {city['id']} - '{city['nombre']}' ({city['created_at']})")
-            
-            if not dry_run:
-                try:
-                    # Actualizar referencias en distancias si existen
-                    # Buscar distancias que referencien la ciudad a eliminar
-                    dist_result = db.supabase.table('distancias').select('*').or_(f'ciudad1.eq.{city["nombre"]},ciudad2.eq.{city["nombre"]}').execute()
-                    
-                    # Actualizar referencias a la ciudad que mantenemos
-                    for dist in dist_result.data:
-                        update_data = {}
-                        if dist['ciudad1'] == city['nombre']:
-                            update_data['ciudad1'] = keep_city['nombre']
-                        if dist['ciudad2'] == city['nombre']:
-                            update_data['ciudad2'] = keep_city['nombre']
-                        
-                        if update_data:
-                            db.supabase.table('distancias').update(update_data).eq('id', dist['id']).execute()
-                    
-                    # Eliminar la ciudad duplicada
-                    db.supabase.table('ciudades').delete().eq('id', city['id']).execute()
-                    
-                    total_removed += 1
-                    logger.info(f"    ✅ Eliminada ciudad ID {city['id']}")
-                    
-                except Exception as e:
-                    logger.error(f"    ❌ Error al eliminar ciudad ID {city['id']}: {e}")
+            if city['nombre'] != keep_city['nombre']:
+                renames[city['nombre']] = keep_city['nombre']
+            delete_ids.append(city['id'])
     
     if dry_run:
-        logger.info(f"\n🧪 DRY RUN: Se eliminarían {sum(len(cities) - 1 for cities in duplicates.values())} ciudades duplicadas")
+        logger.info(f"\n🧪 DRY RUN: Se eliminarían {len(delete_ids)} ciudades duplicadas")
         logger.info("Para ejecutar los cambios, ejecuta: python fix_duplicate_cities.py --execute")
-    else:
-        logger.info(f"\n✅ Proceso completado. Eliminadas {total_removed} ciudades duplicadas")
+        return
+    
+    try:
+        if renames:
+            # Distancias que referencian alguna de las ciudades a eliminar
+            nombres = list(renames)
+            distancias = {}
+            for columna in ('ciudad1', 'ciudad2'):
+                result = db.supabase.table('distancias').select('id, ciudad1, ciudad2, distancia').in_(columna, nombres).execute()
+                for dist in result.data:
+                    distancias[dist['id']] = dist
+            
+            # Actualizar referencias a las ciudades que mantenemos
+            renamed = [
+                {
+                    **dist,
+                    'ciudad1': renames.get(dist['ciudad1'], dist['ciudad1']),
+                    'ciudad2': renames.get(dist['ciudad2'], dist['ciudad2'])
+                }
+                for dist in sorted(distancias.values(), key=lambda d: d['id'])
+            ]
+            
+            # Pares (ciudad1, ciudad2) que ya existen en filas que no se renombran
+            existing_pairs = set()
+            if renamed:
+                result = (db.supabase.table('distancias').select('id, ciudad1, ciudad2')
+                          .in_('ciudad1', list({d['ciudad1'] for d in renamed}))
+                          .in_('ciudad2', list({d['ciudad2'] for d in renamed}))
+                          .execute())
+                existing_pairs = {
+                    (dist['ciudad1'], dist['ciudad2'])
+                    for dist in result.data if dist['id'] not in distancias
+                }
+            
+            # distancias tiene UNIQUE(ciudad1, ciudad2): se conserva una fila por par
+            # y se eliminan las que chocarían al renombrar
+            updates = []
+            redundant_ids = []
+            for dist in renamed:
+                pair = (dist['ciudad1'], dist['ciudad2'])
+                if pair in existing_pairs:
+                    redundant_ids.append(dist['id'])
+                else:
+                    existing_pairs.add(pair)
+                    updates.append(dist)
+            
+            if redundant_ids:
+                db.supabase.table('distancias').delete().in_('id', redundant_ids).execute()
+                logger.info(f"    🗑️ Eliminadas {len(redundant_ids)} distancias repetidas")
+            if updates:
+                db.supabase.table('distancias').upsert(updates).execute()
+                logger.info(f"    ✅ Actualizadas {len(updates)} distancias")
+        
+        # Eliminar las ciudades duplicadas
+        db.supabase.table('ciudades').delete().in_('id', delete_ids).execute()
+        logger.info(f"\n✅ Proceso completado. Eliminadas {len(delete_ids)} ciudades duplicadas")
+        
+    except Exception as e:
+        logger.error(f"    ❌ Error al eliminar ciudades duplicadas: {e}")
 
 
 def update_existing_cities_to_normalized():
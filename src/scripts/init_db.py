@@ -31,7 +31,7 @@ def init_database():
         # Cargar cada ciudad de referencia
         for ciudad in ciudades_referencia:
             try:
-                coords = calculator._get_coordinates(ciudad["nombre"], ciudad["provincia"])
+                coords = calculator.get_coordinates(ciudad["nombre"], ciudad["provincia"])
                 if coords:
                     logger.info(f"Ciudad de referencia cargada: {ciudad['nombre']} ({coords[0]}, {coords[1]})")
                 else:
@@ -1,40 +1,70 @@
 import logging
 from typing import Optional, Tuple, List, Dict
 import requests
-from geopy.distance import geodesic
+from requests.adapters import HTTPAdapter
+import numpy as np
+from geopy.distance import great_circle
 from geopy.geocoders import Nominatim
-from ..database.cache_manager import DistanceCacheManager
-from ..database.db_manager import DatabaseManager
+from database.cache_manager import DistanceCacheManager
+from database.db_manager import DatabaseManager
+from utils.geo import haversine_matrix, search_radius_km
+import threading
 import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
 logger = logging.getLogger(__name__)
 
+# Margen sobre el radio para descartar pares por su distancia en línea recta
+RADIO_MARGIN = 1.005
+
 class RateLimiter:
     def __init__(self, max_calls_per_minute: int):
         self.max_calls = max_calls_per_minute
-        self.calls = []
+        self.calls = deque()
         self.window = 60  # 1 minute window
+        self._lock = threading.Lock()  # Shared across worker threads
 
     def wait_if_needed(self):
-        """Wait if we've made too many calls in the last minute."""
-        now = time.time()
-        # Remove calls older than 1 minute
-        self.calls = [t for t in self.calls if now - t < self.window]
+        """Wait if we've made too many calls in the last minute.
         
-        if len(self.calls) >= self.max_calls:
-            sleep_time = self.window - (now - self.calls[0])
-            if sleep_time > 0:
-                time.sleep(sleep_time)
+        Each caller reserves its time slot under the lock and sleeps outside it,
+        so concurrent threads wait in parallel while the global rate still holds.
+        """
+        with self._lock:
+            now = time.time()
+            # Remove calls older than 1 minute (oldest first)
+            while self.calls and now - self.calls[0] >= self.window:
+                self.calls.popleft()
+            
+            slot = now
+            if len(self.calls) >= self.max_calls:
+                # Wait until the call max_calls positions back leaves the window
+                slot = max(now, self.calls[-self.max_calls] + self.window)
+            self.calls.append(slot)
         
-        self.calls.append(now)
+        sleep_time = slot - now
+        if sleep_time > 0:
+            time.sleep(sleep_time)
 
 class OptimizedDistanceService:
-    def __init__(self, db_manager: DatabaseManager, osrm_url: str = "http://router.project-osrm.org/route/v1"):
+    def __init__(self, db_manager: DatabaseManager, osrm_url: str = "http://router.project-osrm.org/route/v1",
+                 max_workers: int = 8):
         self.cache = DistanceCacheManager(db_manager)
+        self.max_workers = max_workers  # Concurrent OSRM requests, still bound by osrm_limiter
         self.osrm_url = osrm_url
+        # Conexiones persistentes (keep-alive) para las peticiones a OSRM
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=10, pool_maxsize=20)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
         self.osrm_limiter = RateLimiter(60)  # 60 calls per minute for OSRM
         self.geopy_limiter = RateLimiter(100)  # 100 calls per minute for Geopy
         self.geocoder = Nominatim(user_agent="destinos_interinos")
+        # Índices en memoria de centros y ciudades de referencia (ver _load_indices)
+        self._centro_idx = {}
+        self._ref_idx = {}
+        self._indices_version = None
 
     def _get_coordinates(self, centro_id: int, ciudad_id: int) -> Tuple[Tuple[float, float], Tuple[float, float]]:
         """Get coordinates for both center and city."""
@@ -67,7 +97,7 @@ class OptimizedDistanceService:
         try:
             self.osrm_limiter.wait_if_needed()
             url = f"{self.osrm_url}/driving/{start[1]},{start[0]};{end[1]},{end[0]}"
-            response = requests.get(url)
+            response = self.session.get(url, timeout=5)
             response.raise_for_status()
             data = response.json()
             
@@ -80,41 +110,139 @@ class OptimizedDistanceService:
             return None
 
     def _calculate_geopy_distance(self, start: Tuple[float, float], end: Tuple[float, float]) -> float:
-        """Calculate distance using Geopy."""
+        """Calculate distance using Geopy (spherical approximation)."""
         self.geopy_limiter.wait_if_needed()
-        return geodesic(start, end).kilometers
+        return great_circle(start, end).kilometers
 
-    def calcular_distancia(self, centro_id: int, ciudad_id: int) -> float:
-        """Calculate distance with caching and fallback strategy."""
+    def calcular_distancia(self, centro_id: int, ciudad_id: int,
+                           centro_coords: Optional[Tuple[float, float]] = None,
+                           ciudad_coords: Optional[Tuple[float, float]] = None) -> float:
+        """Calculate distance with caching and fallback strategy.
+        
+        If both coordinate pairs are given they are used directly instead of
+        being looked up in the database.
+        """
         # Try cache first
         cached_distance = self.cache.obtener_distancia_cached(centro_id, ciudad_id)
         if cached_distance is not None:
             print(f"Distancia obtenida de la base de datos entre centro_id {centro_id} y ciudad_id {ciudad_id}: {cached_distance:.1f} km")
             return cached_distance
 
+        return self._calcular_distancia_nueva(centro_id, ciudad_id, centro_coords, ciudad_coords)
+
+    def _calcular_distancia_nueva(self, centro_id: int, ciudad_id: int,
+                                  centro_coords: Optional[Tuple[float, float]] = None,
+                                  ciudad_coords: Optional[Tuple[float, float]] = None,
+                                  pendientes: Optional[List[Tuple]] = None) -> float:
+        """Calculate and cache a distance that is not in the cache yet.
+        
+        If a pendientes list is given, the result is appended to it to be saved
+        later in bulk (see DistanceCacheManager.guardar_distancias) instead of
+        being written immediately.
+        """
         # Get coordinates
-        centro_coords, ciudad_coords = self._get_coordinates(centro_id, ciudad_id)
+        if centro_coords is None or ciudad_coords is None:
+            centro_coords, ciudad_coords = self._get_coordinates(centro_id, ciudad_id)
 
         # Try OSRM first
         osrm_distance = self._calculate_osrm_distance(centro_coords, ciudad_coords)
         if osrm_distance is not None:
-            self.cache.guardar_distancia(centro_id, ciudad_id, osrm_distance, 'osrm')
+            self._guardar(centro_id, ciudad_id, osrm_distance, 'osrm', pendientes)
             print(f"Distancia calculada con OSRM entre centro_id {centro_id} y ciudad_id {ciudad_id}: {osrm_distance:.1f} km")
             return osrm_distance
 
         # Fallback to Geopy
         geopy_distance = self._calculate_geopy_distance(centro_coords, ciudad_coords)
-        self.cache.guardar_distancia(centro_id, ciudad_id, geopy_distance, 'geopy')
+        self._guardar(centro_id, ciudad_id, geopy_distance, 'geopy', pendientes)
         print(f"Distancia calculada con Geopy entre centro_id {centro_id} y ciudad_id {ciudad_id}: {geopy_distance:.1f} km")
         return geopy_distance
 
+    def _guardar(self, centro_id: int, ciudad_id: int, distancia: float, tipo_api: str,
+                 pendientes: Optional[List[Tuple]] = None):
+        """Save a distance now, or queue it in pendientes for a bulk save."""
+        if pendientes is None:
+            self.cache.guardar_distancia(centro_id, ciudad_id, distancia, tipo_api)
+        else:
+            pendientes.append((centro_id, ciudad_id, distancia, tipo_api))
+
     def _clean_location_name(self, name: str) -> str:
         """Remove IES prefix and clean location name."""
-        # Remove IES prefix if it exists
-        if name.upper().startswith('IES '):
+        # Remove IES prefix if it exists (any case); only the first 4 chars are uppercased
+        if name[:4].upper() == 'IES ':
             name = name[4:]
         return name.strip()
 
+    def _load_indices(self):
+        """
+        Carga en memoria los IDs y coordenadas de centros y ciudades de referencia.
+        
+        Solo se recargan cuando cambia la versión de las tablas (número de filas,
+        último ID y última geocodificación), que se comprueba con una única
+        consulta barata.
+        """
+        with self.cache.db.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT
+                    (SELECT COUNT(*) FROM centros_educativos),
+                    (SELECT MAX(id) FROM centros_educativos),
+                    (SELECT MAX(fecha_geocodificacion) FROM centros_educativos),
+                    (SELECT COUNT(*) FROM ciudades_referencia),
+                    (SELECT MAX(id) FROM ciudades_referencia),
+                    (SELECT MAX(fecha_geocodificacion) FROM ciudades_referencia)
+            """)
+            version = cursor.fetchone()
+            if version == self._indices_version:
+                return
+            
+            ref_idx = {}
+            cursor.execute("SELECT id, nombre_normalizado, latitud, longitud FROM ciudades_referencia")
+            for ciudad_id, nombre, lat, lon in cursor:
+                ref_idx[nombre] = (ciudad_id, (lat, lon))
+            
+            centro_idx = {}
+            cursor.execute("SELECT id, municipio, provincia, latitud, longitud FROM centros_educativos ORDER BY id")
+            for centro_id, municipio, provincia, lat, lon in cursor:
+                # Como antes, se usa el primer centro del municipio
+                centro_idx.setdefault((municipio, provincia), (centro_id, (lat, lon)))
+        
+        self._ref_idx, self._centro_idx = ref_idx, centro_idx
+        self._indices_version = version
+
+    def _prefetch_ids(self, reference_locations: List[Dict], localities: List[Dict]) -> Tuple[Dict, Dict]:
+        """
+        Obtiene los IDs y coordenadas de las ciudades de referencia y centros pedidos.
+        
+        Args:
+            reference_locations: Localidades de referencia
+            localities: Localidades (ya limpias) con 'Localidad' y 'Provincia'
+            
+        Returns:
+            Tupla (ciudades, centros): {nombre_normalizado: (id, (lat, lon))} y
+            {(municipio, provincia): (id, (lat, lon))}
+        """
+        self._load_indices()
+        ciudades = {}
+        for ref in reference_locations:
+            nombre = ref['nombre'].lower()
+            if nombre in self._ref_idx:
+                ciudades[nombre] = self._ref_idx[nombre]
+        centros = {}
+        for loc in localities:
+            clave = (loc['Localidad'], loc['Provincia'])
+            if clave in self._centro_idx:
+                centros[clave] = self._centro_idx[clave]
+        return ciudades, centros
+
+    @staticmethod
+    def _coords_radianes(entradas: List[Optional[Tuple]]) -> np.ndarray:
+        """Convierte entradas (id, (lat, lon)) en un array (N, 2) en radianes; NaN si faltan."""
+        coords = np.full((len(entradas), 2), np.nan)
+        for i, entrada in enumerate(entradas):
+            if entrada and None not in entrada[1]:
+                coords[i] = entrada[1]
+        return np.radians(coords)
+
     def sort_localities_by_distance(self, reference_locations: List[Dict], localities: List[Dict]) -> List[Dict]:
         """
         Ordena las localidades siguiendo el criterio de proximidad a las localidades de referencia.
@@ -151,39 +279,52 @@ class OptimizedDistanceService:
                     'Provincia': str(loc['Provincia'])
                 })
         
-        # Para cada localidad, calcular su distancia a cada punto de referencia
+        # Obtener todos los IDs y coordenadas de una vez
+        ciudades, centros = self._prefetch_ids(reference_locations, all_localities)
+        
+        # Y todas las distancias ya cacheadas en una sola pasada
+        cached = self.cache.obtener_distancias_cached_bulk([
+            (centro_id, ciudad_id)
+            for centro_id, _ in centros.values()
+            for ciudad_id, _ in ciudades.values()
+        ])
+        
+        # Distancias en línea recta de todos los pares de una vez: son una cota
+        # inferior de la distancia por carretera
+        centros_localidades = [centros.get((loc['Localidad'], loc['Provincia'])) for loc in all_localities]
+        ciudades_ref = [ciudades.get(ref['nombre'].lower()) for ref in reference_locations]
+        coords_localidades = self._coords_radianes(centros_localidades)
+        coords_ref = self._coords_radianes(ciudades_ref)
+        cotas = haversine_matrix(coords_localidades[:, 0], coords_localidades[:, 1],
+                                 coords_ref[:, 0], coords_ref[:, 1])
+        
+        # Para cada localidad, calcular su distancia a cada punto de referencia;
+        # las distancias nuevas se guardan todas juntas al final
         locality_distances = []
-        for locality in all_localities:
+        nuevas = []
+        for i, locality in enumerate(all_localities):
             distances = []
-            for ref_loc in reference_locations:
+            centro = centros_localidades[i]
+            for j, ref_loc in enumerate(reference_locations):
+                radio = search_radius_km(ref_loc)
                 try:
-                    # Obtener IDs de la base de datos
-                    with self.cache.db.get_connection() as conn:
-                        cursor = conn.cursor()
-                        
-                        # Obtener ID de la ciudad de referencia
-                        cursor.execute("""
-                            SELECT id FROM ciudades_referencia 
-                            WHERE nombre_normalizado = ?
-                        """, (ref_loc['nombre'].lower(),))
-                        ciudad_id = cursor.fetchone()
-                        
-                        # Obtener ID del centro
-                        cursor.execute("""
-                            SELECT id FROM centros_educativos 
-                            WHERE municipio = ? AND provincia = ?
-                        """, (locality['Localidad'], locality['Provincia']))
-                        centro_id = cursor.fetchone()
-                        
-                        if ciudad_id and centro_id:
-                            distance = self.calcular_distancia(centro_id[0], ciudad_id[0])
-                            # Verificar si la localidad está dentro del radio de la ciudad de referencia
-                            if distance <= ref_loc.get('radio', 50):
-                                distances.append((ref_loc['nombre'], distance))
-                                logger.info(f"Localidad {locality['Localidad']} ({locality['Provincia']}) dentro del radio de {ref_loc['nombre']} ({distance:.1f} km)")
-                            else:
-                                logger.info(f"Localidad {locality['Localidad']} ({locality['Provincia']}) fuera del radio de {ref_loc['nombre']} ({distance:.1f} km > {ref_loc.get('radio', 50)} km)")
-                                distances.append((ref_loc['nombre'], float('inf')))
+                    ciudad = ciudades_ref[j]
+                    
+                    if ciudad and centro:
+                        distance = cached.get((centro[0], ciudad[0]))
+                        if distance is None and cotas[i, j] > radio * RADIO_MARGIN:
+                            # Fuera del radio seguro: no hace falta consultar OSRM
+                            distance = float(cotas[i, j])
+                        elif distance is None:
+                            distance = self._calcular_distancia_nueva(centro[0], ciudad[0], centro[1], ciudad[1], nuevas)
+                            cached[(centro[0], ciudad[0])] = distance
+                        # Verificar si la localidad está dentro del radio (0 = sin límite)
+                        if distance <= radio:
+                            distances.append((ref_loc['nombre'], distance))
+                            logger.info(f"Localidad {locality['Localidad']} ({locality['Provincia']}) dentro del radio de {ref_loc['nombre']} ({distance:.1f} km)")
+                        else:
+                            logger.info(f"Localidad {locality['Localidad']} ({locality['Provincia']}) fuera del radio de {ref_loc['nombre']} ({distance:.1f} km > {ref_loc.get('radio', 50)} km)")
+                            distances.append((ref_loc['nombre'], float('inf')))
                 except Exception as e:
                     logger.error(f"Error calculando distancia entre {ref_loc['nombre']} y {locality['Localidad']}: {str(e)}")
                     distances.append((ref_loc['nombre'], float('inf')))
@@ -193,15 +334,17 @@ class OptimizedDistanceService:
             closest_ref_index = -1
             closest_ref_name = ""
             
-            for i, (ref_name, dist) in enumerate(distances):
+            for k, (ref_name, dist) in enumerate(distances):
                 if dist < min_distance:
                     min_distance = dist
-                    closest_ref_index = i
+                    closest_ref_index = k
                     closest_ref_name = ref_name
             
             locality_distances.append((locality, min_distance, closest_ref_index, closest_ref_name))
             logger.info(f"Localidad {locality['Localidad']} ({locality['Provincia']}) más cercana a {closest_ref_name} (índice {closest_ref_index})")
         
+        self.cache.guardar_distancias(nuevas)
+        
         # Filtrar localidades que están fuera del radio de su referencia más cercana
         valid_locality_distances = [item for item in locality_distances if item[1] != float('inf')]
 
@@ -225,21 +368,29 @@ class OptimizedDistanceService:
         
         return final_order
 
+    def _actualizar_distancia(self, centro_id: int, ciudad_id: int) -> bool:
+        """Recalculate one Geopy distance with OSRM. Returns True if it was updated."""
+        try:
+            centro_coords, ciudad_coords = self._get_coordinates(centro_id, ciudad_id)
+            osrm_distance = self._calculate_osrm_distance(centro_coords, ciudad_coords)
+            
+            if osrm_distance is not None:
+                self.cache.guardar_distancia(centro_id, ciudad_id, osrm_distance, 'osrm')
+                return True
+        except Exception as e:
+            logger.error(f"Failed to update distance for {centro_id}-{ciudad_id}: {str(e)}")
+        return False
+
     def actualizar_distancias_geopy(self) -> int:
-        """Update distances marked for update from Geopy to OSRM."""
-        updated_count = 0
+        """Update distances marked for update from Geopy to OSRM.
+        
+        Requests run concurrently on a thread pool; the shared OSRM rate
+        limiter keeps the overall request rate within budget.
+        """
         pendientes = self.cache.obtener_pendientes_actualizacion()
+        if not pendientes:
+            return 0
         
-        for centro_id, ciudad_id in pendientes:
-            try:
-                centro_coords, ciudad_coords = self._get_coordinates(centro_id, ciudad_id)
-                osrm_distance = self._calculate_osrm_distance(centro_coords, ciudad_coords)
-                
-                if osrm_distance is not None:
-                    self.cache.guardar_distancia(centro_id, ciudad_id, osrm_distance, 'osrm')
-                    updated_count += 1
-            except Exception as e:
-                logger.error(f"Failed to update distance for {centro_id}-{ciudad_id}: {str(e)}")
-                continue
-        
-        return updated_count 
\ No newline at end of file
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            resultados = executor.map(lambda par: self._actualizar_distancia(*par), pendientes)
+            return sum(resultados)
\ No newline at end of file
@@ -1,18 +1,34 @@
 import logging
-from typing import Optional, Tuple, List
+from typing import Dict, Optional, Tuple, List
 import pandas as pd
 from geopy.geocoders import Nominatim
 from geopy.exc import GeocoderTimedOut, GeocoderUnavailable
-from ..database.db_manager import DatabaseManager
+from database.db_manager import DatabaseManager
 import time
 
 logger = logging.getLogger(__name__)
 
+# Centers inserted per executemany/commit
+INSERT_BATCH_SIZE = 500
+# (municipio, provincia) pairs per lookup, below SQLite's parameter limit
+LOOKUP_CHUNK_SIZE = 400
+
 class GeocodingService:
     def __init__(self, db_manager: DatabaseManager):
         self.db = db_manager
         self.geocoder = Nominatim(user_agent="destinos_interinos")
         self.cache = {}  # Simple in-memory cache for geocoding results
+        self._prewarm_cache()
+
+    def _prewarm_cache(self):
+        """Load every geocoded reference city into the in-memory cache."""
+        try:
+            with self.db.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("SELECT nombre_normalizado, latitud, longitud FROM ciudades_referencia")
+                self.cache.update((nombre, (lat, lon)) for nombre, lat, lon in cursor)
+        except Exception as e:
+            logger.warning(f"Could not prewarm geocoding cache: {str(e)}")
 
     def _normalize_location(self, location: str) -> str:
         """Normalize location string for consistent lookups."""
@@ -26,7 +42,11 @@ class GeocodingService:
         """Geocode a city and store in database."""
         nombre_normalizado = self._normalize_location(nombre_ciudad)
         
-        # Check database first
+        # Check memory cache first (prewarmed from the database)
+        if nombre_normalizado in self.cache:
+            return self.cache[nombre_normalizado]
+        
+        # Then the database, in case another process geocoded it
         with self.db.get_connection() as conn:
             cursor = conn.cursor()
             cursor.execute("""
@@ -37,12 +57,9 @@ class GeocodingService:
             result = cursor.fetchone()
             
             if result:
+                self.cache[nombre_normalizado] = result
                 return result
 
-        # Check memory cache
-        if nombre_normalizado in self.cache:
-            return self.cache[nombre_normalizado]
-
         # Geocode with Nominatim
         try:
             location = self.geocoder.geocode(f"{nombre_ciudad}, Spain")
@@ -82,40 +99,81 @@ class GeocodingService:
             logger.error(f"Geocoding failed for {location_str}: {str(e)}")
             return None
 
+    def _coordenadas_existentes(self, ubicaciones: List[Tuple[str, str]]) -> Dict[Tuple[str, str], Tuple[float, float]]:
+        """Get stored coordinates of already geocoded (municipio, provincia) pairs."""
+        coords = {}
+        with self.db.get_connection() as conn:
+            cursor = conn.cursor()
+            for i in range(0, len(ubicaciones), LOOKUP_CHUNK_SIZE):
+                chunk = ubicaciones[i:i + LOOKUP_CHUNK_SIZE]
+                values = ",".join("(?, ?)" for _ in chunk)
+                cursor.execute(f"""
+                    SELECT municipio, provincia, latitud, longitud
+                    FROM centros_educativos
+                    WHERE geocodificado AND latitud IS NOT NULL
+                    AND (municipio, provincia) IN (VALUES {values})
+                """, [value for pair in chunk for value in pair])
+                for municipio, provincia, lat, lon in cursor:
+                    coords[(municipio, provincia)] = (lat, lon)
+        return coords
+
+    def _insertar_centros(self, batch: List[Tuple]) -> int:
+        """Insert a batch of geocoded centers with a single commit."""
+        try:
+            with self.db.get_connection() as conn:
+                conn.executemany("""
+                    INSERT INTO centros_educativos 
+                        (nombre, direccion, municipio, provincia, tipo, 
+                         latitud, longitud, geocodificado)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, TRUE)
+                """, batch)
+                conn.commit()
+            return len(batch)
+        except Exception as e:
+            logger.error(f"Failed to import batch of {len(batch)} centers: {str(e)}")
+            return 0
+
     def importar_centros_desde_csv(self, ruta_csv: str) -> int:
-        """Import school centers from CSV and geocode them."""
+        """Import school centers from CSV and geocode them.
+        
+        Locations already geocoded (in the database or earlier in the same file)
+        are reused, so Nominatim is only called, and rate limited, for new ones.
+        Rows are inserted in batches of INSERT_BATCH_SIZE.
+        """
         try:
             df = pd.read_csv(ruta_csv)
             imported_count = 0
             
-            for _, row in df.iterrows():
+            # Column-wise cleanup instead of per-row work
+            df['direccion'] = df['direccion'].fillna('') if 'direccion' in df.columns else ''
+            df['municipio'] = df['municipio'].str.strip()
+            df['provincia'] = df['provincia'].str.strip()
+            
+            ubicaciones = list(dict.fromkeys(zip(df['municipio'], df['provincia'])))
+            known = self._coordenadas_existentes(ubicaciones)
+            
+            batch = []
+            columnas = ['nombre', 'direccion', 'municipio', 'provincia', 'tipo']
+            for nombre, direccion, municipio, provincia, tipo in df[columnas].itertuples(index=False, name=None):
                 try:
-                    coords = self.geocodificar_centro(row['municipio'], row['provincia'])
+                    key = (municipio, provincia)
+                    if key not in known:
+                        known[key] = self.geocodificar_centro(municipio, provincia)
+                        # Rate limiting
+                        time.sleep(1)  # Basic rate limiting for Nominatim
+                    coords = known[key]
                     if coords:
-                        with self.db.get_connection() as conn:
-                            cursor = conn.cursor()
-                            cursor.execute("""
-                                INSERT INTO centros_educativos 
-                                    (nombre, direccion, municipio, provincia, tipo, 
-                                     latitud, longitud, geocodificado)
-                                VALUES (?, ?, ?, ?, ?, ?, ?, TRUE)
-                            """, (
-                                row['nombre'],
-                                row.get('direccion', ''),
-                                row['municipio'],
-                                row['provincia'],
-                                row['tipo'],
-                                coords[0],
-                                coords[1]
-                            ))
-                            conn.commit()
-                            imported_count += 1
+                        batch.append((nombre, direccion, municipio, provincia, tipo, coords[0], coords[1]))
                 except Exception as e:
-                    logger.error(f"Failed to import center {row.get('nombre', 'unknown')}: {str(e)}")
+                    logger.error(f"Failed to import center {nombre}: {str(e)}")
                     continue
                 
-                # Rate limiting
-                time.sleep(1)  # Basic rate limiting for Nominatim
+                if len(batch) >= INSERT_BATCH_SIZE:
+                    imported_count += self._insertar_centros(batch)
+                    batch = []
+            
+            if batch:
+                imported_count += self._insertar_centros(batch)
             
             return imported_count
         except Exception as e:
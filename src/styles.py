@@ -2,6 +2,8 @@
 Estilos personalizados para la aplicación Streamlit.
 """
 
+import re
+
 CUSTOM_CSS = """
 <style>
 /* Variables de colores */
@@ -61,7 +63,8 @@ h1 {
     transition: transform 0.2s;
 }
 
-.metric-card:hover {
+.metric-card:hover,
+.result-card:hover {
     transform: translateY(-2px);
     box-shadow: 0 4px 8px rgba(0,0,0,0.1);
 }
@@ -116,11 +119,6 @@ h1 {
     transition: all 0.3s ease;
 }
 
-.result-card:hover {
-    transform: translateY(-2px);
-    box-shadow: 0 4px 8px rgba(0,0,0,0.1);
-}
-
 /* Badges */
 .badge {
     display: inline-block;
@@ -162,7 +160,28 @@ footer {
 </style>
 """
 
+# Expresiones regulares precompiladas para minimizar el CSS
+_CSS_COMMENT_RE = re.compile(r'/\*.*?\*/', re.S)
+_CSS_SPACES_RE = re.compile(r'\s+')
+_CSS_PUNCT_SPACES_RE = re.compile(r'\s*([{};])\s*')
+
+
+def _minify_css(css: str) -> str:
+    """Elimina comentarios y espacios innecesarios del CSS."""
+    css = _CSS_COMMENT_RE.sub('', css)
+    css = _CSS_SPACES_RE.sub(' ', css)
+    css = _CSS_PUNCT_SPACES_RE.sub(r'\1', css)
+    return css.strip()
+
+
+# Se minimiza una sola vez al importar; Streamlit vuelve a enviar el bloque en
+# cada rerun (los elementos que no se emiten desaparecen), así que cuanto menor, mejor
+_CUSTOM_CSS_MIN = _minify_css(CUSTOM_CSS)
+
+
 def apply_custom_styles():
     """Aplica los estilos personalizados a la aplicación."""
     import streamlit as st
-    st.markdown(CUSTOM_CSS, unsafe_allow_html=True) 
\ No newline at end of file
+    # st.html con solo etiquetas <style> no pasa por el parser de Markdown ni
+    # ocupa espacio en la página
+    st.html(_CUSTOM_CSS_MIN) 
\ No newline at end of file
@@ -3,8 +3,44 @@ Utilidades para normalizar nombres de ciudades y evitar duplicados en la base de
 """
 
 import re
+import string
 import unicodedata
-from typing import List, Dict
+from functools import lru_cache
+from typing import List, Dict, Union
+
+# Letras acentuadas habituales -> letra base (la misma que deja la descomposición NFD)
+_ACCENTED = 'áéíóúüñçàèìòùâêîôûäëïöÁÉÍÓÚÜÑÇÀÈÌÒÙÂÊÎÔÛÄËÏÖ'
+_ACCENT_TABLE = str.maketrans({c: unicodedata.normalize('NFD', c)[0] for c in _ACCENTED})
+
+# Signos de puntuación ASCII (todo lo que no es \w ni \s) -> espacio
+_PUNCT_TABLE = str.maketrans({c: ' ' for c in string.punctuation if c != '_'})
+
+# Tabla combinada: mayúsculas -> minúsculas, acentuadas -> letra base en minúscula
+# y puntuación -> espacio, todo en una sola pasada
+_NORMALIZE_TABLE = str.maketrans({
+    **{c: c.lower() for c in string.ascii_uppercase},
+    **{c: unicodedata.normalize('NFD', c.lower())[0] for c in _ACCENTED},
+    **{c: ' ' for c in string.punctuation if c != '_'},
+})
+
+# Solo para los signos no ASCII que no cubre la tabla anterior
+_NON_WORD_RE = re.compile(r'[^\w\s]')
+
+
+def _clean_punctuation(text: str) -> str:
+    """
+    Sustituye los signos de puntuación por espacios y colapsa los espacios.
+    
+    Args:
+        text (str): Texto sin acentos
+        
+    Returns:
+        str: Texto con palabras separadas por un único espacio
+    """
+    text = text.translate(_PUNCT_TABLE)
+    if not text.isascii():
+        text = _NON_WORD_RE.sub(' ', text)
+    return ' '.join(text.split())
 
 
 class CityNameNormalizer:
@@ -27,6 +63,10 @@ class CityNameNormalizer:
         ' de arriba', ' de abajo', ' alto', ' bajo'
     ]
     
+    # Los más largos primero, para que 'de la ' se elimine antes que 'de '
+    _PREFIX_SORTED = tuple(sorted(PREFIJOS_COMUNES, key=len, reverse=True))
+    _SUFFIX_SORTED = tuple(sorted(SUFIJOS_COMUNES, key=len, reverse=True))
+    
     @staticmethod
     def normalize_city_name(city_name: str) -> str:
         """
@@ -49,16 +89,62 @@ class CityNameNormalizer:
         if not city_name or not isinstance(city_name, str):
             return ""
         
+        # Los resultados se memorizan: los mismos nombres se repiten en muchas filas
+        return _cached_normalize(city_name)
+    
+    @staticmethod
+    def _normalize(city_name: str) -> str:
+        """
+        Aplica los pasos de normalización sin memorizar el resultado.
+        
+        Args:
+            city_name (str): Nombre original de la ciudad (cadena no vacía)
+            
+        Returns:
+            str: Nombre normalizado de la ciudad
+        """
+        # Pasos 1-3: minúsculas, sin acentos ni signos y espacios normalizados
+        normalized = CityNameNormalizer._strip_and_clean(city_name)
+        
+        return CityNameNormalizer._remove_affixes(normalized)
+    
+    @staticmethod
+    def _strip_and_clean(text: str) -> str:
+        """
+        Pasa el texto a minúsculas, quita acentos y signos y normaliza espacios,
+        sin eliminar prefijos ni sufijos.
+        
+        Args:
+            text (str): Nombre original de la ciudad
+            
+        Returns:
+            str: Texto limpio
+        """
+        # Caso habitual: una sola pasada con la tabla combinada
+        cleaned = text.translate(_NORMALIZE_TABLE)
+        if cleaned.isascii():
+            return ' '.join(cleaned.split())
+        
         # Paso 1: Convertir a minúsculas
-        normalized = city_name.lower().strip()
+        normalized = text.lower().strip()
         
         # Paso 2: Eliminar acentos y caracteres especiales
         normalized = CityNameNormalizer._remove_accents(normalized)
         
         # Paso 3: Eliminar caracteres especiales y normalizar espacios
-        normalized = re.sub(r'[^\w\s]', ' ', normalized)
-        normalized = re.sub(r'\s+', ' ', normalized).strip()
+        return _clean_punctuation(normalized)
+    
+    @staticmethod
+    def _remove_affixes(normalized: str) -> str:
+        """
+        Elimina el prefijo y el sufijo común de un texto ya limpio.
         
+        Args:
+            normalized (str): Texto devuelto por _strip_and_clean
+            
+        Returns:
+            str: Nombre normalizado de la ciudad
+        """
         # Paso 4: Eliminar prefijos comunes
         normalized = CityNameNormalizer._remove_prefixes(normalized)
         
@@ -70,6 +156,11 @@ class CityNameNormalizer:
         
         return normalized
     
+    @staticmethod
+    def cache_clear():
+        """Vacía la caché de nombres normalizados (p. ej. entre tests)."""
+        _cached_normalize.cache_clear()
+    
     @staticmethod
     def _remove_accents(text: str) -> str:
         """
@@ -81,7 +172,16 @@ class CityNameNormalizer:
         Returns:
             str: Texto sin acentos
         """
-        # Normalizar usando NFD (Canonical Decomposition)
+        # Sin caracteres no ASCII no hay nada que quitar
+        if text.isascii():
+            return text
+        
+        # Las letras acentuadas habituales se resuelven con la tabla
+        text = text.translate(_ACCENT_TABLE)
+        if text.isascii():
+            return text
+        
+        # Resto de casos: normalizar usando NFD (Canonical Decomposition)
         nfd = unicodedata.normalize('NFD', text)
         # Filtrar solo caracteres que no sean marcas diacríticas
         without_accents = ''.join(char for char in nfd if unicodedata.category(char) != 'Mn')
@@ -98,10 +198,14 @@ class CityNameNormalizer:
         Returns:
             str: Texto sin prefijos comunes
         """
-        for prefix in CityNameNormalizer.PREFIJOS_COMUNES:
-            if text.startswith(prefix):
-                text = text[len(prefix):].strip()
-                break  # Solo eliminar el primer prefijo encontrado
+        # Descarte rápido en una sola llamada: la mayoría de nombres no tienen prefijo
+        if not text.startswith(CityNameNormalizer._PREFIX_SORTED):
+            return text
+        
+        for prefix in CityNameNormalizer._PREFIX_SORTED:
+            new = text.removeprefix(prefix)
+            if len(new) != len(text):
+                return new.strip()  # Solo eliminar el primer prefijo encontrado
         
         return text
     
@@ -116,10 +220,13 @@ class CityNameNormalizer:
         Returns:
             str: Texto sin sufijos comunes
         """
-        for suffix in CityNameNormalizer.SUFIJOS_COMUNES:
-            if text.endswith(suffix):
-                text = text[:-len(suffix)].strip()
-                break  # Solo eliminar el primer sufijo encontrado
+        if not text.endswith(CityNameNormalizer._SUFFIX_SORTED):
+            return text
+        
+        for suffix in CityNameNormalizer._SUFFIX_SORTED:
+            new = text.removesuffix(suffix)
+            if len(new) != len(text):
+                return new.strip()  # Solo eliminar el primer sufijo encontrado
         
         return text
     
@@ -137,50 +244,76 @@ class CityNameNormalizer:
         if not city_name:
             return []
         
-        variations = set()
-        normalized = CityNameNormalizer.normalize_city_name(city_name)
+        # La limpieza se hace una sola vez y sirve para ambas versiones
+        original_normalized = CityNameNormalizer._strip_and_clean(city_name)
+        normalized = CityNameNormalizer._remove_affixes(original_normalized)
         
-        # Agregar la versión normalizada
-        variations.add(normalized)
+        # Versión normalizada, versiones con prefijos comunes y la versión
+        # original normalizada (sin eliminar prefijos), sin repetidos y en orden
+        candidates = [f"{prefix}{normalized}" for prefix in ('la ', 'el ', 'san ', 'santa ')]
+        candidates.append(original_normalized)
         
-        # Agregar versiones con prefijos comunes
-        for prefix in ['la ', 'el ', 'san ', 'santa ']:
-            variations.add(f"{prefix}{normalized}")
+        variations = [normalized]
+        for candidate in candidates:
+            if candidate not in variations:
+                variations.append(candidate)
         
-        # Agregar la versión original normalizada (sin eliminar prefijos)
-        original_normalized = CityNameNormalizer._remove_accents(city_name.lower().strip())
-        original_normalized = re.sub(r'[^\w\s]', ' ', original_normalized)
-        original_normalized = re.sub(r'\s+', ' ', original_normalized).strip()
-        variations.add(original_normalized)
+        return variations
+    
+    @staticmethod
+    def build_normalized_index(city_list: List[str]) -> Dict[str, List[str]]:
+        """
+        Agrupa una lista de ciudades por su nombre normalizado.
         
-        return list(variations)
+        Args:
+            city_list (List[str]): Lista de ciudades existentes
+            
+        Returns:
+            Dict[str, List[str]]: Nombre normalizado -> nombres originales, en orden
+        """
+        index = {}
+        for city in city_list:
+            index.setdefault(CityNameNormalizer.normalize_city_name(city), []).append(city)
+        return index
     
     @staticmethod
-    def find_similar_cities(city_name: str, city_list: List[str], threshold: float = 0.8) -> List[Dict[str, str]]:
+    def find_similar_cities(city_name: str, city_list: Union[List[str], Dict[str, List[str]]],
+                            threshold: float = 0.8) -> List[Dict[str, str]]:
         """
         Encuentra ciudades similares en una lista basándose en la normalización.
         
+        Para consultar muchos nombres contra la misma lista, conviene pasar el
+        índice de build_normalized_index para no normalizarla en cada llamada.
+        
         Args:
             city_name (str): Nombre de ciudad a buscar
-            city_list (List[str]): Lista de ciudades existentes
+            city_list: Lista de ciudades existentes o índice de build_normalized_index
             threshold (float): Umbral de similitud (no usado en esta implementación básica)
             
         Returns:
             List[Dict[str, str]]: Lista de ciudades similares con sus versiones normalizadas
         """
+        if isinstance(city_list, dict):
+            index = city_list
+        else:
+            index = CityNameNormalizer.build_normalized_index(city_list)
+        
         normalized_target = CityNameNormalizer.normalize_city_name(city_name)
-        similar_cities = []
         
-        for city in city_list:
-            normalized_city = CityNameNormalizer.normalize_city_name(city)
-            if normalized_city == normalized_target:
-                similar_cities.append({
-                    'original': city,
-                    'normalized': normalized_city,
-                    'match_type': 'exact'
-                })
-        
-        return similar_cities
+        return [
+            {
+                'original': city,
+                'normalized': normalized_target,
+                'match_type': 'exact'
+            }
+            for city in index.get(normalized_target, [])
+        ]
+
+
+@lru_cache(maxsize=65536)
+def _cached_normalize(city_name: str) -> str:
+    """Versión memorizada de CityNameNormalizer._normalize."""
+    return CityNameNormalizer._normalize(city_name)
 
 
 # Función de conveniencia para uso directo
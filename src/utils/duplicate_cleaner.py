@@ -4,6 +4,9 @@ Utilidad para limpiar duplicados de ciudades directamente desde Streamlit.
 
 import streamlit as st
 import logging
+from collections import defaultdict
+from itertools import groupby
+from operator import itemgetter
 from typing import Dict, List
 from .city_normalizer import normalize_city_name
 
@@ -13,6 +16,9 @@ logger = logging.getLogger(__name__)
 class DuplicateCleaner:
     """Limpiador de ciudades duplicadas para usar en Streamlit."""
     
+    # Filas por página al descargar la tabla de ciudades (máximo por defecto de Supabase)
+    PAGE_SIZE = 1000
+    
     def __init__(self, db_manager):
         """
         Inicializa el limpiador con un gestor de base de datos.
@@ -26,37 +32,62 @@ class DuplicateCleaner:
         """
         Encuentra ciudades duplicadas basándose en nombres normalizados.
         
+        El resultado se cachea durante 5 minutos y se invalida al eliminar una
+        ciudad (ver _find_duplicates_cached). Los errores no se cachean, así que
+        la siguiente búsqueda vuelve a consultar la base de datos.
+        
         Returns:
-            Dict con grupos de ciudades duplicadas
+            Dict con grupos de ciudades duplicadas (vacío si hubo un error)
         """
         try:
-            # Obtener todas las ciudades
-            result = self.db.supabase.table('ciudades').select('*').order('created_at').execute()
-            cities = result.data
-            
-            if not cities:
-                return {}
-            
-            # Agrupar por nombre normalizado
-            normalized_groups = {}
-            
-            for city in cities:
-                normalized_name = normalize_city_name(city['nombre'])
-                
-                if normalized_name not in normalized_groups:
-                    normalized_groups[normalized_name] = []
-                
-                normalized_groups[normalized_name].append(city)
-            
-            # Filtrar solo los grupos con duplicados
-            duplicates = {k: v for k, v in normalized_groups.items() if len(v) > 1}
-            
-            return duplicates
-            
+            return _find_duplicates_cached(self.db)
         except Exception as e:
             logger.error(f"Error buscando duplicados: {e}")
             return {}
     
+    def _query_duplicates(self) -> Dict[str, List[Dict]]:
+        """
+        Consulta en la base de datos las ciudades duplicadas.
+        
+        La agrupación se hace en el servidor con la función find_duplicate_cities()
+        sobre la columna indexada nombre_normalizado (ver sql/create_tables.sql).
+        Si no está disponible, se descargan todas las ciudades y se agrupan en local.
+        
+        Returns:
+            Dict con grupos de ciudades duplicadas
+            
+        Raises:
+            Exception: Si tampoco se pueden descargar las ciudades
+        """
+        try:
+            # Las filas llegan ordenadas por nombre normalizado y fecha de creación
+            result = self.db.supabase.rpc('find_duplicate_cities').execute()
+            return {
+                k: list(group)
+                for k, group in groupby(result.data or [], key=itemgetter('nombre_normalizado'))
+            }
+        except Exception as e:
+            logger.warning(f"Función find_duplicate_cities no disponible, agrupando en local: {e}")
+        
+        # Descargar las ciudades por páginas y agruparlas por nombre normalizado
+        # a medida que llegan (en orden de creación)
+        normalized_groups = defaultdict(list)
+        offset = 0
+        while True:
+            page = self.db.supabase.table('ciudades').select('id, nombre, provincia, created_at').order('created_at').order('id').range(
+                offset, offset + self.PAGE_SIZE - 1
+            ).execute().data
+            
+            for city in page or []:
+                normalized_groups[normalize_city_name(city['nombre'])].append(city)
+            
+            if not page or len(page) < self.PAGE_SIZE:
+                break
+            offset += self.PAGE_SIZE
+        
+        # Filtrar solo los grupos con duplicados
+        return {k: v for k, v in normalized_groups.items() if len(v) > 1}
+    
     def remove_duplicate(self, city_id: int, keep_city_name: str) -> bool:
         """
         Elimina una ciudad duplicada y actualiza referencias.
@@ -70,40 +101,95 @@ class DuplicateCleaner:
         """
         try:
             # Obtener información de la ciudad a eliminar
-            city_result = self.db.supabase.table('ciudades').select('*').eq('id', city_id).execute()
+            city_result = self.db.supabase.table('ciudades').select('nombre').eq('id', city_id).execute()
             if not city_result.data:
                 return False
             
             city_to_remove = city_result.data[0]
             
-            # Actualizar referencias en tabla de distancias si existe
+            # Actualizar referencias en tabla de distancias; si falla, la ciudad se
+            # mantiene para no dejar distancias apuntando a un nombre eliminado
             try:
-                # Buscar distancias que referencien la ciudad a eliminar
-                dist_result = self.db.supabase.table('distancias').select('*').or_(
-                    f'ciudad1.eq.{city_to_remove["nombre"]},ciudad2.eq.{city_to_remove["nombre"]}'
-                ).execute()
-                
-                # Actualizar referencias
-                for dist in dist_result.data:
-                    update_data = {}
-                    if dist['ciudad1'] == city_to_remove['nombre']:
-                        update_data['ciudad1'] = keep_city_name
-                    if dist['ciudad2'] == city_to_remove['nombre']:
-                        update_data['ciudad2'] = keep_city_name
-                    
-                    if update_data:
-                        self.db.supabase.table('distancias').update(update_data).eq('id', dist['id']).execute()
+                self._update_distance_references(city_to_remove['nombre'], keep_city_name)
             except Exception as e:
-                logger.warning(f"Error actualizando referencias de distancias: {e}")
+                logger.error(f"Error actualizando referencias de distancias de la ciudad {city_id}: {e}")
+                return False
             
             # Eliminar la ciudad
             self.db.supabase.table('ciudades').delete().eq('id', city_id).execute()
             
+            # Los duplicados cacheados ya no son válidos
+            _find_duplicates_cached.clear()
+            
             return True
             
         except Exception as e:
             logger.error(f"Error eliminando ciudad {city_id}: {e}")
             return False
+    
+    def _update_distance_references(self, nombre: str, keep_city_name: str):
+        """
+        Renombra a keep_city_name las distancias que referencian nombre.
+        
+        distancias tiene UNIQUE(ciudad1, ciudad2), así que antes de los dos UPDATE
+        en bloque (uno por columna) se eliminan las filas cuyo par renombrado ya
+        existe o se repite; se conserva una fila por par.
+        
+        Args:
+            nombre: Nombre de la ciudad que se elimina
+            keep_city_name: Nombre de la ciudad que se mantiene
+        """
+        # Filas que referencian la ciudad a eliminar, con su par ya renombrado
+        renamed = {}
+        for columna in ('ciudad1', 'ciudad2'):
+            result = self.db.supabase.table('distancias').select('id, ciudad1, ciudad2').eq(columna, nombre).execute()
+            for dist in result.data:
+                renamed[dist['id']] = tuple(
+                    keep_city_name if ciudad == nombre else ciudad
+                    for ciudad in (dist['ciudad1'], dist['ciudad2'])
+                )
+        if not renamed:
+            return
+        
+        # Pares que ya existen en filas que no se renombran
+        result = (self.db.supabase.table('distancias').select('id, ciudad1, ciudad2')
+                  .in_('ciudad1', list({c1 for c1, _ in renamed.values()}))
+                  .in_('ciudad2', list({c2 for _, c2 in renamed.values()}))
+                  .execute())
+        existing_pairs = {
+            (dist['ciudad1'], dist['ciudad2'])
+            for dist in result.data if dist['id'] not in renamed
+        }
+        
+        redundant_ids = []
+        for dist_id in sorted(renamed):
+            if renamed[dist_id] in existing_pairs:
+                redundant_ids.append(dist_id)
+            else:
+                existing_pairs.add(renamed[dist_id])
+        
+        if redundant_ids:
+            self.db.supabase.table('distancias').delete().in_('id', redundant_ids).execute()
+            logger.info(f"Eliminadas {len(redundant_ids)} distancias repetidas de {nombre}")
+        self.db.supabase.table('distancias').update({'ciudad1': keep_city_name}).eq('ciudad1', nombre).execute()
+        self.db.supabase.table('distancias').update({'ciudad2': keep_city_name}).eq('ciudad2', nombre).execute()
+
+
+@st.cache_data(ttl=300, show_spinner=False)
+def _find_duplicates_cached(_db) -> Dict[str, List[Dict]]:
+    """
+    Versión cacheada de DuplicateCleaner._query_duplicates.
+    
+    Streamlit no cachea las excepciones, así que un fallo transitorio de
+    Supabase no deja un resultado vacío en caché durante 5 minutos.
+    
+    Args:
+        _db: Gestor de base de datos (el guion bajo evita que Streamlit lo use como clave)
+        
+    Returns:
+        Dict con grupos de ciudades duplicadas
+    """
+    return DuplicateCleaner(_db)._query_duplicates()
 
 
 def render_duplicate_cleaner_ui():
@@ -137,9 +223,7 @@ def render_duplicate_cleaner_ui():
         for normalized_name, cities in duplicates.items():
             st.subheader(f"📍 Grupo: '{normalized_name}'")
             
-            # Ordenar por fecha de creación (más antigua primero)
-            cities.sort(key=lambda x: x.get('created_at', ''))
-            
+            # Las ciudades ya llegan ordenadas por fecha de creación (más antigua primero)
             # Mostrar información de cada ciudad
             cols = st.columns(len(cities))
             
@@ -0,0 +1,78 @@
+"""
+Utilidades geográficas para el cálculo masivo de distancias.
+"""
+
+import math
+from typing import Dict
+
+import numpy as np
+
+# Radio medio de la Tierra en kilómetros
+EARTH_RADIUS_KM = 6371.0
+
+# Radio de búsqueda por defecto de una ciudad de preferencia
+DEFAULT_SEARCH_RADIUS_KM = 50
+
+
+def search_radius_km(ciudad: Dict) -> float:
+    """
+    Obtiene el radio de búsqueda de una ciudad de preferencia.
+    
+    Un radio 0 significa sin límite de distancia, como indica la interfaz.
+    
+    Args:
+        ciudad: Diccionario de la ciudad, con la clave opcional 'radio'
+        
+    Returns:
+        Radio en kilómetros (infinito si no hay límite)
+    """
+    radio = ciudad.get('radio', DEFAULT_SEARCH_RADIUS_KM)
+    return float(radio) if radio else math.inf
+
+
+def haversine_matrix(lat1: np.ndarray,
+                     lon1: np.ndarray,
+                     lat2: np.ndarray,
+                     lon2: np.ndarray,
+                     out: np.ndarray = None) -> np.ndarray:
+    """
+    Calcula la distancia de círculo máximo entre dos conjuntos de puntos.
+    
+    Todas las operaciones se hacen en bloque y sobre el array de salida,
+    sin bucles de Python ni matrices intermedias innecesarias.
+    
+    Args:
+        lat1, lon1: Coordenadas en radianes de los N puntos de origen
+        lat2, lon2: Coordenadas en radianes de los M puntos de destino
+        out: Array (N, M) opcional donde escribir el resultado
+        
+    Returns:
+        Matriz (N, M) con las distancias en kilómetros
+    """
+    lat1 = np.asarray(lat1, dtype=float)
+    lon1 = np.asarray(lon1, dtype=float)
+    lat2 = np.asarray(lat2, dtype=float)
+    lon2 = np.asarray(lon2, dtype=float)
+    if out is None:
+        out = np.empty((lat1.shape[0], lat2.shape[0]))
+    
+    # sin²(Δlat/2)
+    np.subtract(lat2[np.newaxis, :], lat1[:, np.newaxis], out=out)
+    out *= 0.5
+    np.sin(out, out=out)
+    np.square(out, out=out)
+    
+    # cos(lat1)·cos(lat2)·sin²(Δlon/2)
+    termino_lon = np.subtract(lon2[np.newaxis, :], lon1[:, np.newaxis])
+    termino_lon *= 0.5
+    np.sin(termino_lon, out=termino_lon)
+    np.square(termino_lon, out=termino_lon)
+    termino_lon *= np.outer(np.cos(lat1), np.cos(lat2))
+    out += termino_lon
+    
+    # Evitar valores ligeramente mayores que 1 por redondeo
+    np.minimum(out, 1.0, out=out)
+    np.sqrt(out, out=out)
+    np.arcsin(out, out=out)
+    out *= 2 * EARTH_RADIUS_KM
+    return out
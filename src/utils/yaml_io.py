@@ -0,0 +1,59 @@
+"""
+Utilidades para leer y escribir ficheros YAML de configuración de forma segura.
+"""
+
+import os
+import shutil
+import tempfile
+from pathlib import Path
+from typing import Any, Union
+
+import yaml
+
+try:
+    from yaml import CSafeDumper as SafeDumper, CSafeLoader as SafeLoader
+except ImportError:  # PyYAML compilado sin libyaml
+    from yaml import SafeDumper, SafeLoader
+
+
+def load_yaml(stream: Any) -> Any:
+    """
+    Equivalente a yaml.safe_load, pero con el cargador en C (libyaml) si está disponible.
+    
+    Args:
+        stream: Fichero abierto o cadena con el YAML
+        
+    Returns:
+        Datos leídos del YAML
+    """
+    return yaml.load(stream, Loader=SafeLoader)
+
+
+def write_yaml_atomic(data: Any, path: Union[str, Path]) -> None:
+    """
+    Escribe datos en un fichero YAML sin dejarlo nunca a medio escribir.
+    
+    Se vuelca primero a un fichero temporal con nombre único junto al destino
+    y después se sustituye el original con os.replace, que es atómico en el
+    mismo sistema de ficheros. Si el destino ya existe se conservan sus
+    permisos (settings.yaml guarda la API key); si no, el fichero queda con
+    los permisos de tempfile.mkstemp (solo el propietario). Se respeta el
+    orden de las claves.
+    
+    Args:
+        data: Datos serializables a YAML
+        path: Ruta del fichero destino
+    """
+    path = Path(path)
+    fd, tmp_name = tempfile.mkstemp(dir=path.parent, prefix=path.name, suffix=".tmp")
+    tmp_path = Path(tmp_name)
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            yaml.dump(data, f, Dumper=SafeDumper, sort_keys=False,
+                      default_flow_style=False, allow_unicode=True)
+        if path.exists():
+            shutil.copymode(path, tmp_path)
+        os.replace(tmp_path, path)
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
@@ -0,0 +1,48 @@
+"""
+Fixtures compartidas por los tests.
+"""
+
+import re
+from types import MappingProxyType
+import pytest
+import requests_mock
+
+# Configuración mínima del LLM para los tests
+MOCK_CONFIG = MappingProxyType({
+    'llm': {
+        'models': {
+            'mistral': {
+                'name': 'test-model',
+                'api_url': 'http://test-api'
+            }
+        },
+        'temperature': 0.7,
+        'max_tokens': 100
+    }
+})
+
+# Respuestas fijas de las APIs externas
+OSRM_RESPONSE = {'code': 'Ok', 'routes': [{'distance': 100000}]}
+NOMINATIM_RESPONSE = [{
+    'lat': '37.1773',
+    'lon': '-3.5986',
+    'display_name': 'Granada, Andalucía, España'
+}]
+
+@pytest.fixture(scope='session')
+def http_mock():
+    """
+    Fixture que sustituye OSRM y Nominatim por respuestas fijas durante toda la sesión.
+    
+    Se instala una sola vez en lugar de parchear requests en cada test, así que
+    los tests que cuenten llamadas deben hacerlo sobre la diferencia de call_count.
+    """
+    with requests_mock.Mocker() as mock:
+        mock.get(re.compile(r'https?://router\.project-osrm\.org/route/v1/'), json=OSRM_RESPONSE)
+        mock.get(re.compile(r'https?://nominatim\.openstreetmap\.org/'), json=NOMINATIM_RESPONSE)
+        yield mock
+
+@pytest.fixture(scope='session')
+def mock_config():
+    """Fixture con la configuración del LLM, de solo lectura y compartida por todos los tests."""
+    return MOCK_CONFIG
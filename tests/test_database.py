@@ -1,28 +1,34 @@
 import os
 import pytest
-import tempfile
-import shutil
 from datetime import datetime
 from database.db_manager import DatabaseManager
 from database.cache_manager import DistanceCacheManager
 from services.geocoding_service import GeocodingService
 
+@pytest.fixture(scope='session')
+def session_db(tmp_path_factory):
+    """Fixture con una base de datos temporal compartida (el esquema se crea una sola vez)."""
+    # Directorio temporal para la base de datos y los backups
+    temp_dir = tmp_path_factory.mktemp('db')
+    os.makedirs(temp_dir / 'backups', exist_ok=True)
+    
+    return DatabaseManager(str(temp_dir / 'test.db'))
+
 @pytest.fixture
-def temp_db():
-    """Fixture para crear una base de datos temporal para testing."""
-    # Crear directorio temporal para la base de datos
-    temp_dir = tempfile.mkdtemp()
-    db_path = os.path.join(temp_dir, 'test.db')
-    
-    # Crear directorio temporal para backups
-    backup_dir = os.path.join(temp_dir, 'backups')
-    os.makedirs(backup_dir, exist_ok=True)
+def temp_db(session_db):
+    """Fixture que entrega la base de datos compartida y la vacía (tablas y contadores de ids) al terminar cada test."""
+    yield session_db
     
-    db_manager = DatabaseManager(db_path)
-    yield db_manager
-    
-    # Eliminar el directorio temporal y todo su contenido
-    shutil.rmtree(temp_dir, ignore_errors=True)
+    with session_db.get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%'")
+        for (table,) in cursor.fetchall():
+            cursor.execute(f"DELETE FROM {table}")
+        # Reiniciar los contadores AUTOINCREMENT para que los ids no dependan del orden de los tests
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='sqlite_sequence'")
+        if cursor.fetchone():
+            cursor.execute("DELETE FROM sqlite_sequence")
+        conn.commit()
 
 @pytest.fixture
 def cache_manager(temp_db):
@@ -69,6 +75,17 @@ def test_distance_cache(cache_manager):
     # Verificar que no existe para otro par
     assert cache_manager.obtener_distancia_cached(2, 2) is None
 
+def test_distance_cache_bulk(cache_manager):
+    """Test de la consulta en bloque de la caché de distancias."""
+    cache_manager.guardar_distancia(1, 1, 10.0, 'osrm')
+    cache_manager.guardar_distancia(1, 2, 20.0, 'geopy')
+    
+    cached = cache_manager.obtener_distancias_cached_bulk([(1, 1), (1, 2), (2, 1)])
+    assert cached == {(1, 1): 10.0, (1, 2): 20.0}
+    
+    # Las distancias de Geopy quedan marcadas para actualizar
+    assert cache_manager.obtener_pendientes_actualizacion() == [(1, 2)]
+
 def test_coordinate_validation(temp_db):
     """Test de validación de coordenadas."""
     # Coordenadas válidas en España
@@ -1,7 +1,9 @@
 import pytest
 from unittest.mock import patch, MagicMock
-from distance_calculator import DistanceCalculator
+from distance_calculator import DistanceCalculator, RequestThrottle
 import pandas as pd
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 @pytest.fixture
 def calculator():
@@ -24,15 +26,10 @@ def test_get_coordinates_external(mock_nominatim, calculator):
     assert coords[1] == pytest.approx(-3.6, abs=0.01)
 
 @patch('src.distance_calculator.DistanceCalculator._get_coordinates')
-@patch('src.distance_calculator.requests.get')
-def test_get_distance_osrm(mock_requests_get, mock_get_coords, calculator):
+def test_get_distance_osrm(mock_get_coords, http_mock, calculator):
     # Simular coordenadas
     mock_get_coords.side_effect = [(37.18, -3.6), (36.72, -4.42)]
-    # Simular respuesta OSRM
-    mock_response = MagicMock()
-    mock_response.status_code = 200
-    mock_response.json.return_value = {'code': 'Ok', 'routes': [{'distance': 100000}]}
-    mock_requests_get.return_value = mock_response
+    # La respuesta de OSRM (100 km) la da el fixture http_mock
     dist = calculator.get_distance('Granada', 'Granada', 'Malaga', 'Malaga')
     assert abs(dist - 100.0) < 0.01
 
@@ -97,4 +94,18 @@ def test_sort_localities_by_distance(calculator):
         # Should only include Granada since it's within radius
         assert len(sorted_locs) == 1
         assert sorted_locs[0]['Localidad'] == 'Granada'
-        assert sorted_locs[0]['Provincia'] == 'Granada'
\ No newline at end of file
+        assert sorted_locs[0]['Provincia'] == 'Granada'
+
+def test_request_throttle_spaces_calls_across_threads():
+    throttle = RequestThrottle(0.05)
+    instantes = []
+
+    def llamar(_):
+        throttle.wait()
+        instantes.append(time.monotonic())
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        list(executor.map(llamar, range(4)))
+    instantes.sort()
+    # Cada hilo sale al menos un intervalo después del anterior
+    assert all(b - a >= 0.045 for a, b in zip(instantes, instantes[1:]))
@@ -4,34 +4,16 @@ from exceptions import (
     DatosError, ValidacionError, APIError, ArchivoError
 )
 
-def test_preferencia_interinos_error():
-    with pytest.raises(PreferenciaInterinosError):
-        raise PreferenciaInterinosError("Error base")
-
-def test_configuracion_error():
-    with pytest.raises(ConfiguracionError):
-        raise ConfiguracionError("Error de configuración")
-
-def test_llm_error():
-    with pytest.raises(LLMError):
-        raise LLMError("Error LLM")
-
-def test_distancia_error():
-    with pytest.raises(DistanciaError):
-        raise DistanciaError("Error de distancia")
-
-def test_datos_error():
-    with pytest.raises(DatosError):
-        raise DatosError("Error de datos")
-
-def test_validacion_error():
-    with pytest.raises(ValidacionError):
-        raise ValidacionError("Error de validación")
-
-def test_api_error():
-    with pytest.raises(APIError):
-        raise APIError("Error de API")
-
-def test_archivo_error():
-    with pytest.raises(ArchivoError):
-        raise ArchivoError("Error de archivo") 
\ No newline at end of file
+@pytest.mark.parametrize("exc, mensaje", [
+    (PreferenciaInterinosError, "Error base"),
+    (ConfiguracionError, "Error de configuración"),
+    (LLMError, "Error LLM"),
+    (DistanciaError, "Error de distancia"),
+    (DatosError, "Error de datos"),
+    (ValidacionError, "Error de validación"),
+    (APIError, "Error de API"),
+    (ArchivoError, "Error de archivo"),
+])
+def test_exception_raises(exc, mensaje):
+    with pytest.raises(exc):
+        raise exc(mensaje)
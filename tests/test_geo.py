@@ -0,0 +1,33 @@
+import numpy as np
+import pytest
+from utils.geo import haversine_matrix, search_radius_km
+
+
+def test_haversine_matrix_known_distances():
+    # Granada, Málaga y Sevilla
+    lat = np.radians([37.1773, 36.7213, 37.3891])
+    lon = np.radians([-3.5986, -4.4214, -5.9845])
+    result = haversine_matrix(lat, lon, lat, lon)
+
+    assert result.shape == (3, 3)
+    assert np.allclose(np.diag(result), 0.0)
+    assert np.allclose(result, result.T)
+    assert result[0, 1] == pytest.approx(89, abs=2)
+    assert result[0, 2] == pytest.approx(211, abs=3)
+
+
+def test_haversine_matrix_writes_into_out():
+    lat1, lon1 = np.radians([37.1773]), np.radians([-3.5986])
+    lat2, lon2 = np.radians([36.7213, 37.3891]), np.radians([-4.4214, -5.9845])
+    out = np.empty((1, 2))
+
+    result = haversine_matrix(lat1, lon1, lat2, lon2, out=out)
+
+    assert result is out
+    assert np.allclose(out, haversine_matrix(lat1, lon1, lat2, lon2))
+
+
+def test_search_radius_km_zero_means_no_limit():
+    assert search_radius_km({'radio': 30}) == 30.0
+    assert search_radius_km({}) == 50.0
+    assert search_radius_km({'radio': 0}) == np.inf
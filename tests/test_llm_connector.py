@@ -1,160 +1,219 @@
 import pytest
-import os
-from unittest.mock import Mock, patch, MagicMock, mock_open
+import copy
+import yaml
+from types import MappingProxyType
+from unittest.mock import Mock, patch, mock_open
 from llm_connector import LLMConnector
-from exceptions import LLMError, ConfiguracionError, ValidacionError, APIError
-from distance_calculator import DistanceCalculator
-import requests
 
-@pytest.fixture
-def mock_config():
-    return {
-        'llm': {
-            'models': {
-                'mistral': {
-                    'name': 'test-model',
-                    'api_url': 'http://test-api'
-                }
-            },
-            'temperature': 0.7,
-            'max_tokens': 100
-        }
-    }
+@pytest.fixture(scope='module')
+def config_file(mock_config):
+    """
+    Fixture que sirve la configuración simulada al abrir el archivo de settings.
+    
+    Solo la necesitan los tests que comprueban la lectura del YAML; el resto pasa
+    la configuración ya cargada al LLMConnector. Solo se parchea el open del
+    módulo llm_connector.
+    """
+    yaml_config = yaml.safe_dump(dict(mock_config))
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setattr('llm_connector.open', mock_open(read_data=yaml_config), raising=False)
+        yield
+
+# Casos de normalización de nombres de ciudades (entrada, esperado)
+# (_normalize_city_name conserva las mayúsculas; solo recorta espacios y el prefijo IES)
+_NORMALIZE_CASES = (
+    ("madrid", "madrid"),
+    ("SAN SEBASTIAN", "SAN SEBASTIAN"),
+    ("la-zubia", "la-zubia"),
+    ("IES Motril", "Motril"),
+    ("  Baza ", "Baza"),
+)
+
+# Datos de entrada de generate_prompt, de solo lectura: si el conector los
+# modificase, el test fallaría
+_PROVINCIAS = ("Granada",)
+_CIUDADES = (
+    MappingProxyType({"nombre": "Granada", "radio": 50}),
+    MappingProxyType({"nombre": "Motril", "radio": 50}),
+)
+_CENTROS = (
+    MappingProxyType({"Localidad": "Granada", "Provincia": "Granada", "Nombre": "Centro 1"}),
+    MappingProxyType({"Localidad": "Motril", "Provincia": "Granada", "Nombre": "Centro 2"}),
+    MappingProxyType({"Localidad": "Salobreña", "Provincia": "Granada", "Nombre": "Centro 3"}),
+)
+
+# Distancias (localidad, ciudad de referencia) que devuelve el calculador simulado
+_DISTANCIAS = {}
+
+class _FakeDistanceCalculator:
+    """Calculador de distancias en memoria: lo no definido en _DISTANCIAS está a 100 km."""
+    
+    def get_distance(self, location1, province1, location2, province2):
+        return _DISTANCIAS.get((location1, location2), 100.0)
+
+@pytest.fixture(scope='module', autouse=True)
+def fake_distance_calculator():
+    """Fixture que sustituye el DistanceCalculator del conector mientras se ejecuta este módulo."""
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setattr('llm_connector.DistanceCalculator', _FakeDistanceCalculator)
+        yield
 
 @pytest.fixture
-def calculator():
-    """Fixture para el calculador de distancias."""
-    return DistanceCalculator()
+def distancias():
+    """Tabla de distancias del calculador simulado, vacía al terminar cada test."""
+    yield _DISTANCIAS
+    _DISTANCIAS.clear()
+
+@pytest.fixture(scope='module', autouse=True)
+def mistral_key():
+    """
+    Fixture que define la API key de Mistral una sola vez para este módulo.
+    
+    También anula load_dotenv para que un .env local no intervenga en los tests.
+    """
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setenv('MISTRAL_API_KEY', 'test-key')
+        mp.setattr('llm_connector.load_dotenv', lambda *args, **kwargs: None)
+        yield
+
+@pytest.fixture(scope='module')
+def shared_llm_connector(mock_config, fake_distance_calculator, mistral_key):
+    """Fixture con un LLMConnector construido una sola vez para este módulo."""
+    return LLMConnector(config=mock_config)
 
 @pytest.fixture
-def llm_connector(mock_config, monkeypatch):
-    monkeypatch.setenv('MISTRAL_API_KEY', 'test-key')
-    with patch('yaml.safe_load', return_value=mock_config):
-        return LLMConnector()
+def llm_connector(shared_llm_connector):
+    """Copia del conector compartido que cada test puede modificar sin afectar a los demás."""
+    connector = copy.copy(shared_llm_connector)
+    connector.distance_calculator = copy.copy(shared_llm_connector.distance_calculator)
+    return connector
 
-@patch('src.llm_connector.load_dotenv')
-def test_init_success(mock_load_dotenv, mock_config, monkeypatch):
+def test_init_success(config_file):
     """Test de inicialización exitosa del LLMConnector."""
-    monkeypatch.setenv('MISTRAL_API_KEY', 'test-key')
-    with patch('yaml.safe_load', return_value=mock_config):
-        llm_connector = LLMConnector()
-        assert llm_connector.model == 'test-model'
-        assert llm_connector.api_url == 'http://test-api'
-        assert llm_connector.headers['Authorization'] == 'Bearer test-key'
-
-@patch('src.llm_connector.load_dotenv')
-def test_normalize_city_name(mock_load_dotenv, mock_config, monkeypatch):
+    llm_connector = LLMConnector()
+    assert llm_connector.model == 'test-model'
+    assert llm_connector.api_url == 'http://test-api'
+    assert llm_connector.headers['Authorization'] == 'Bearer test-key'
+
+@pytest.mark.parametrize("raw,expected", _NORMALIZE_CASES)
+def test_normalize_city_name(llm_connector, raw, expected):
     """Test de normalización de nombres de ciudades."""
-    monkeypatch.setenv('MISTRAL_API_KEY', 'test-key')
-    with patch('yaml.safe_load', return_value=mock_config):
-        connector = LLMConnector()
-        assert connector._normalize_city_name("madrid") == "Madrid"
-        assert connector._normalize_city_name("SAN SEBASTIAN") == "San Sebastian"
-        assert connector._normalize_city_name("la-zubia") == "La Zubia"
-
-@patch('src.llm_connector.load_dotenv')
-@patch.object(LLMConnector, '_build_prompt', return_value="mocked prompt")
-@patch.object(LLMConnector, '_sort_centers', return_value=[])
-@patch.object(LLMConnector, '_normalize_city_name', side_effect=lambda x: x)
-@patch('src.llm_connector.DistanceCalculator')
-def test_generate_prompt_grouped_and_numbered(mock_distance_calculator_class, mock_normalize, mock_sort_centers, mock_build_prompt, mock_load_dotenv, mock_config):
+    assert llm_connector._normalize_city_name(raw) == expected
+
+def test_generate_prompt_grouped_and_numbered(llm_connector, distancias):
     """Test de generación de prompt agrupado por ciudad y numerado de forma continua."""
-    # Configure the mock instance returned by the mocked class
-    mock_distance_calculator_instance = mock_distance_calculator_class.return_value
-    def fake_get_distance(location1, province1, location2, province2):
-        if location1 == "Granada":
-            return 5.0 if location2 == "Granada" else 60.0
-        if location1 == "Motril":
-            return 5.0 if location2 == "Motril" else 60.0
-        if location1 == "Salobreña":
-            return 10.0 if location2 == "Granada" else 40.0
-        return 100.0
-    mock_distance_calculator_instance.get_distance.side_effect = fake_get_distance
-
-    connector = LLMConnector()
-    tipo_centro = "IES"
-    provincias = ["Granada"]
-    ciudades_preferencia = [
-        {"nombre": "Granada", "radio": 50},
-        {"nombre": "Motril", "radio": 50}
-    ]
+    distancias.update({
+        ("Granada", "Granada"): 5.0, ("Granada", "Motril"): 60.0,
+        ("Motril", "Motril"): 5.0, ("Motril", "Granada"): 60.0,
+        ("Salobreña", "Granada"): 10.0, ("Salobreña", "Motril"): 40.0,
+    })
+    prompt = llm_connector.generate_prompt(
+        tipo_centro="IES",
+        provincias=_PROVINCIAS,
+        ciudades_preferencia=_CIUDADES,
+        datos_centros=_CENTROS
+    )
+    assert (
+        "Ciudades cercanas a Granada:\n\n"
+        "1. Granada (Granada) - 5.0 km\n"
+        "2. Salobreña (Granada) - 10.0 km\n"
+    ) in prompt
+    assert (
+        "Ciudades cercanas a Motril:\n\n"
+        "3. Motril (Granada) - 5.0 km\n"
+    ) in prompt
+    assert "No se encontraron centros" not in prompt
+
+def test_generate_prompt_no_centros(llm_connector, distancias):
+    """Test de mensaje cuando no hay centros dentro del radio para una ciudad."""
+    prompt = llm_connector.generate_prompt(
+        tipo_centro="IES",
+        provincias=_PROVINCIAS,
+        ciudades_preferencia=_CIUDADES,
+        datos_centros=_CENTROS[:1]
+    )
+    assert "Ciudades cercanas a" not in prompt
+    assert (
+        "No se encontraron centros dentro del radio especificado para:\n"
+        "- Granada (radio: 50 km)\n"
+        "- Motril (radio: 50 km)\n"
+    ) in prompt
+
+def test_generate_prompt_batched_progress(llm_connector):
+    """Test del cálculo de distancias por lotes con notificación de progreso."""
+    distancias = {"Granada": 5.0, "Motril": 20.0, "Salobreña": 10.0}
+    llm_connector.distance_calculator.get_distance = Mock(
+        side_effect=lambda location1, province1, location2, province2: distancias[location1]
+    )
+    llm_connector.batch_size = 2
     datos_centros = [
         {"Localidad": "Granada", "Provincia": "Granada", "Nombre": "Centro 1"},
         {"Localidad": "Motril", "Provincia": "Granada", "Nombre": "Centro 2"},
-        {"Localidad": "Salobreña", "Provincia": "Granada", "Nombre": "Centro 3"}
+        {"Localidad": "Granada", "Provincia": "Granada", "Nombre": "Centro 3"},
+        {"Localidad": "Salobreña", "Provincia": "Granada", "Nombre": "Centro 4"}
     ]
-
-    prompt = connector.generate_prompt(
-        tipo_centro=tipo_centro,
-        provincias=provincias,
-        ciudades_preferencia=ciudades_preferencia,
-        datos_centros=datos_centros
+    progreso = []
+
+    prompt = llm_connector.generate_prompt(
+        tipo_centro="IES",
+        provincias=["Granada"],
+        ciudades_preferencia=[{"nombre": "Granada", "radio": 50}],
+        datos_centros=datos_centros,
+        progress_callback=lambda completados, total: progreso.append((completados, total))
     )
-    assert prompt == "mocked prompt"
-
-@patch('src.llm_connector.load_dotenv')
-@patch.object(LLMConnector, '_build_prompt', return_value="mocked prompt no centros")
-@patch.object(LLMConnector, '_sort_centers', return_value=[])
-@patch.object(LLMConnector, '_normalize_city_name', side_effect=lambda x: x)
-@patch('src.llm_connector.DistanceCalculator')
-def test_generate_prompt_no_centros(mock_distance_calculator_class, mock_normalize, mock_sort_centers, mock_build_prompt, mock_load_dotenv, mock_config):
-    """Test de mensaje cuando no hay centros dentro del radio para una ciudad."""
-    # Configure the mock instance returned by the mocked class
-    mock_distance_calculator_instance = mock_distance_calculator_class.return_value
-    mock_distance_calculator_instance.get_distance.return_value = 100.0
 
-    connector = LLMConnector()
-    tipo_centro = "IES"
-    provincias = ["Granada"]
-    ciudades_preferencia = [
-        {"nombre": "Granada", "radio": 50},
-        {"nombre": "Motril", "radio": 50}
-    ]
-    datos_centros = [
-        {"Localidad": "Granada", "Provincia": "Granada", "Nombre": "Centro 1"}
-    ]
-
-    prompt = connector.generate_prompt(
-        tipo_centro=tipo_centro,
-        provincias=provincias,
-        ciudades_preferencia=ciudades_preferencia,
-        datos_centros=datos_centros
+    # Las localidades repetidas solo se calculan una vez
+    assert llm_connector.distance_calculator.get_distance.call_count == 3
+    assert progreso == [(1, 2), (2, 2)]
+    assert "1. Granada (Granada) - 5.0 km" in prompt
+    assert "2. Salobreña (Granada) - 10.0 km" in prompt
+    assert "3. Motril (Granada) - 20.0 km" in prompt
+
+def test_generate_prompt_from_tuples(llm_connector):
+    """Test de generación del prompt a partir de filas en tuplas y nombres de columnas."""
+    distancias = {"Granada": 5.0, "Motril": 20.0}
+    llm_connector.distance_calculator.get_distance = Mock(
+        side_effect=lambda location1, province1, location2, province2: distancias[location1]
     )
-    assert prompt == "mocked prompt no centros"
-
-@patch('src.llm_connector.load_dotenv')
-def test_process_with_llm_success(mock_load_dotenv, llm_connector):
-    """Test de procesamiento exitoso con LLM."""
-    mock_response = Mock()
-    mock_response.json.return_value = {
-        'choices': [{'message': {'content': 'Test response'}}]
-    }
-    mock_response.raise_for_status = Mock()
-
-    with patch.object(llm_connector.session, 'post', return_value=mock_response):
-        result = llm_connector.process_with_llm("Test prompt")
-        assert result == "Test response"
-
-@patch('src.llm_connector.load_dotenv')
-def test_api_key_preference_env_var(mock_load_dotenv, monkeypatch, mock_config):
-    """Test de preferencia: .env variable is used when no text input key."""
-    monkeypatch.setenv('MISTRAL_API_KEY', 'key_env')
-    with patch('yaml.safe_load', return_value=mock_config):
-        connector = LLMConnector()
-        assert connector.headers['Authorization'] == 'Bearer key_env'
-
-@patch('src.llm_connector.load_dotenv')
-def test_api_key_preference_text_input(mock_load_dotenv, monkeypatch, mock_config):
-    """Test de preferencia: text input key is used over .env variable."""
-    monkeypatch.setenv('MISTRAL_API_KEY', 'key_env')
-    os.environ['MISTRAL_API_KEY'] = 'key_textinput'
-    with patch('yaml.safe_load', return_value=mock_config):
-        connector = LLMConnector()
-        assert connector.headers['Authorization'] == 'Bearer key_textinput'
-    del os.environ['MISTRAL_API_KEY']
-
-@patch('src.llm_connector.load_dotenv')
-def test_build_prompt_no_centros_message(mock_load_dotenv, llm_connector):
+    columnas = ["Nombre", "Localidad", "Provincia"]
+    filas = iter([
+        ("Centro 1", "Motril", "Granada"),
+        ("Centro 2", "Granada", "Granada"),
+    ])
+
+    prompt = llm_connector.generate_prompt(
+        tipo_centro="IES",
+        provincias=["Granada"],
+        ciudades_preferencia=[{"nombre": "Granada", "radio": 50}],
+        datos_centros=filas,
+        columns=columnas
+    )
+
+    assert "1. Granada (Granada) - 5.0 km" in prompt
+    assert "2. Motril (Granada) - 20.0 km" in prompt
+
+def test_process_with_llm_success(llm_connector, monkeypatch):
+    """Test de procesamiento con LLM: por ahora devuelve el prompt formateado sin llamar a la API."""
+    mock_post = Mock()
+    monkeypatch.setattr(llm_connector.session, 'post', mock_post)
+    result = llm_connector.process_with_llm("Test prompt")
+    assert result == "Test prompt"
+    mock_post.assert_not_called()
+
+@pytest.mark.parametrize("env_key,textinput_key,expected_header", [
+    ('key_env', None, 'Bearer key_env'),              # .env variable is used when no text input key
+    ('key_env', 'key_textinput', 'Bearer key_textinput'),  # text input key is used over .env variable
+])
+def test_api_key_preference(monkeypatch, mock_config, env_key, textinput_key, expected_header):
+    """Test de preferencia de la API key: la introducida en la interfaz prevalece sobre la del .env."""
+    monkeypatch.setenv('MISTRAL_API_KEY', env_key)
+    if textinput_key:
+        # La interfaz escribe la clave introducida en el entorno
+        monkeypatch.setenv('MISTRAL_API_KEY', textinput_key)
+    connector = LLMConnector(config=mock_config)
+    assert connector.headers['Authorization'] == expected_header
+
+def test_build_prompt_no_centros_message(llm_connector):
     """Test del mensaje de _build_prompt cuando no hay centros para una ciudad."""
     tipo_centro = "IES"
     provincias = ["Granada"]
@@ -180,6 +239,6 @@ def test_build_prompt_no_centros_message(mock_load_dotenv, llm_connector):
 
         assert "No se encontraron centros dentro del radio especificado para:" in prompt
         assert "- Motril (radio: 50 km)" in prompt
-        assert "Cercanos a Granada:" in prompt
+        assert "Ciudades cercanas a Granada:" in prompt
         assert "1. Granada (Granada) - 5.0 km" in prompt
-        assert "Cercanos a Motril:" not in prompt 
\ No newline at end of file
+        assert "Ciudades cercanas a Motril:" not in prompt 
\ No newline at end of file
@@ -1,34 +1,39 @@
 import pytest
-import pandas as pd
 from processor import DataProcessor
-import os
-import yaml
-from pathlib import Path
 from unittest.mock import patch
 
-def test_load_data(tmp_path):
-    # Crear estructura de carpetas y archivo CSV
-    data_dir = tmp_path / "data"
-    data_dir.mkdir()
-    prov_dir = data_dir / "Granada"
-    prov_dir.mkdir()
-    csv_path = prov_dir / "institutos.csv"
-    df = pd.DataFrame({'codigo': [1], 'nombre': ['Centro'], 'provincia': ['Granada']})
-    df.to_csv(csv_path, index=False)
-    processor = DataProcessor(str(data_dir))
-    result = processor.load_data(['Granada'], 'Institutos (IES)')
-    assert not result.empty
-    assert 'provincia' in result.columns
-
-def test_save_and_load_configuration(tmp_path, monkeypatch):
+def test_load_data():
+    import io
+    import pandas as pd
+    
+    # CSV en memoria con las cabeceras reales y una columna que load_data descarta
+    csv_data = (
+        "Código,Denominación,Nombre,Domicilio,Localidad,Municipio,Provincia,Teléfono\n"
+        "18000001,IES,Centro,Calle Real 1,Granada,Granada,Granada,958000000\n"
+    )
+    read_csv = pd.read_csv
+    rutas = []
+    
+    def read_csv_memoria(path, **kwargs):
+        rutas.append(path)
+        return read_csv(io.StringIO(csv_data), **kwargs)
+    
+    processor = DataProcessor("data")
+    with patch('processor.pd.read_csv', side_effect=read_csv_memoria):
+        result = processor.load_data(['Granada'], 'Institutos (IES)')
+    
+    assert rutas[0].parts[-2:] == ('Granada', 'centros_educativos_secundaria.csv')
+    assert list(result.columns) == [
+        'Código', 'Denominación', 'Nombre', 'Domicilio', 'Localidad', 'Municipio', 'Provincia'
+    ]
+    assert result.loc[0, 'Localidad'] == 'Granada'
+    assert result.loc[0, 'Provincia'] == 'Granada'
+
+def test_save_and_load_configuration(tmp_path):
     config = {'provincias': ['Granada'], 'tipo_centro': 'IES', 'ciudades': [{'nombre': 'Granada', 'radio': 50}]}
     # Use the temporary directory directly for saving configurations
     save_dir = tmp_path / "saved_configs"
-    save_dir.mkdir()
-    processor = DataProcessor() # Initialize with default data_dir
-    
-    # Mock the configuration directory to the temporary directory
-    monkeypatch.setattr('src.processor.Path', lambda *args: save_dir)
+    processor = DataProcessor(config_dir=save_dir)
 
     nombre = "test_config"
     # Guardar
@@ -38,19 +43,43 @@ def test_save_and_load_configuration(tmp_path, monkeypatch):
     config_path = save_dir / f"{nombre}.yaml"
     assert config_path.exists() # Assert the file was created
     
-    # Cargar (use the same processor instance as the directory is mocked globally)
+    # Cargar
     loaded = processor.load_configuration(nombre)
     assert loaded == config # Compare the loaded config with the original
 
-def test_load_configuration_not_found(tmp_path, monkeypatch):
-    processor = DataProcessor()
-    nombre = "no_existe"
+def test_load_configuration_not_found(tmp_path):
     # Use the temporary directory directly for saving configurations
     save_dir = tmp_path / "saved_configs"
     save_dir.mkdir()
-    
-    # Mock the configuration directory to the temporary directory
-    monkeypatch.setattr('src.processor.Path', lambda *args: save_dir)
+    processor = DataProcessor(config_dir=save_dir)
+    nombre = "no_existe"
 
     result = processor.load_configuration(nombre)
-    assert result == {} 
\ No newline at end of file
+    assert result == {} 
+
+def test_process_preferences():
+    import pandas as pd
+    
+    coordenadas = {
+        'Granada': {'latitud': 37.1773, 'longitud': -3.5986},
+        'Armilla': {'latitud': 37.1447, 'longitud': -3.6256},
+        'Motril': {'latitud': 36.7458, 'longitud': -3.5179},
+        'Baza': {'latitud': 37.4904, 'longitud': -2.7731},
+    }
+    processor = DataProcessor()
+    df = pd.DataFrame({
+        'Código': [1, 2, 3, 4],
+        'Localidad': ['Motril', 'Armilla', 'Baza', 'Granada'],
+        'Provincia': ['Granada'] * 4,
+    })
+    ciudades = [{'nombre': 'Motril', 'radio': 10}, {'nombre': 'Granada', 'radio': 20}]
+
+    with patch.object(processor.distance_calculator, 'get_coordinates',
+                      side_effect=lambda loc, prov=None: coordenadas.get(loc)):
+        result = processor.process_preferences(df, ciudades)
+
+    # Baza queda fuera de ambos radios; Motril va primero por prioridad
+    assert [c['Localidad'] for c in result] == ['Motril', 'Granada', 'Armilla']
+    assert [c['ciudad_referencia'] for c in result] == ['Motril', 'Granada', 'Granada']
+    assert result[0]['distancia_km'] == pytest.approx(0.0)
+    assert 2 < result[2]['distancia_km'] < 6
@@ -0,0 +1,25 @@
+import stat
+
+from utils.yaml_io import load_yaml, write_yaml_atomic
+
+
+def test_write_yaml_atomic_keeps_permissions_and_order(tmp_path):
+    destino = tmp_path / "settings.yaml"
+    destino.write_text("llm: {}\n", encoding="utf-8")
+    destino.chmod(0o600)
+
+    write_yaml_atomic({"b": 1, "a": "Almería"}, destino)
+
+    assert stat.S_IMODE(destino.stat().st_mode) == 0o600
+    assert list(load_yaml(destino.read_text(encoding="utf-8"))) == ["b", "a"]
+    # No quedan ficheros temporales junto al destino
+    assert [p.name for p in tmp_path.iterdir()] == ["settings.yaml"]
+
+
+def test_write_yaml_atomic_creates_new_file(tmp_path):
+    destino = tmp_path / "config.yaml"
+
+    write_yaml_atomic({"tipo_centro": "IES"}, destino)
+
+    assert load_yaml(destino.read_text(encoding="utf-8")) == {"tipo_centro": "IES"}
+    assert [p.name for p in tmp_path.iterdir()] == ["config.yaml"]